@@ -0,0 +1,139 @@
+import asyncio
+import math
+import os
+import threading
+import time
+
+from fastapi import HTTPException, Request
+
+# Ingest requests processed at once; the rest wait in a bounded queue or are turned away,
+# so a flood of uploads cannot take every threadpool slot from the read endpoints
+INGEST_MAX_CONCURRENCY = int(os.environ.get("INGEST_MAX_CONCURRENCY", "4"))
+INGEST_MAX_QUEUE = int(os.environ.get("INGEST_MAX_QUEUE", "32"))
+INGEST_QUEUE_TIMEOUT_SECONDS = float(os.environ.get("INGEST_QUEUE_TIMEOUT_SECONDS", "2.0"))
+# Sustained uploads per second and burst size allowed for one device or patient
+INGEST_RATE_PER_SECOND = float(os.environ.get("INGEST_RATE_PER_SECOND", "1.0"))
+INGEST_BURST = float(os.environ.get("INGEST_BURST", "10"))
+# Retry-After sent with 503 responses
+INGEST_RETRY_AFTER_SECONDS = int(os.environ.get("INGEST_RETRY_AFTER_SECONDS", "5"))
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self):
+        # Returns 0 when a token was taken, otherwise the seconds until one is available
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionController:
+    def __init__(self, max_concurrency: int, max_queue: int, queue_timeout: float, rate: float, burst: float, max_buckets: int = 10000):
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._max_concurrency = max_concurrency
+        self._max_queue = max_queue
+        self._queue_timeout = queue_timeout
+        self._rate = rate
+        self._burst = burst
+        self._max_buckets = max_buckets
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self.rejected_rate_limited = 0
+
+    def _unavailable(self):
+        return HTTPException(
+            status_code=503, detail="Ingest is saturated, try again later", headers={"Retry-After": str(INGEST_RETRY_AFTER_SECONDS)}
+        )
+
+    async def admit(self):
+        # FastAPI dependency; runs on the event loop, so queued requests do not hold a thread
+        # Counted on our own counters: requests of one burst all get here before any acquire has run
+        if self.active + self.waiting >= self._max_concurrency + self._max_queue:
+            self.rejected_queue_full += 1
+            raise self._unavailable()
+
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self._queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected_timeout += 1
+            raise self._unavailable()
+        finally:
+            self.waiting -= 1
+
+        self.admitted += 1
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+
+    def check_rate(self, key: str):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self._max_buckets:
+                    self._prune()
+                bucket = self._buckets[key] = TokenBucket(self._rate, self._burst)
+            wait_seconds = bucket.take()
+            if wait_seconds:
+                self.rejected_rate_limited += 1
+        if wait_seconds:
+            raise HTTPException(
+                status_code=429, detail="Too many uploads, try again later", headers={"Retry-After": str(math.ceil(wait_seconds))}
+            )
+
+    def rate_limit(self, key_prefix: str, key_field: str):
+        # FastAPI dependency checking the bucket keyed by a field of the JSON body. List it before `admit`,
+        # so over-rate clients get a fast 429 instead of taking a slot or a queue place.
+        async def check_rate(request: Request):
+            try:
+                body = await request.json()
+            except ValueError:
+                # Left to the endpoint's own validation
+                return
+            key = body.get(key_field) if isinstance(body, dict) else None
+            if key is not None:
+                self.check_rate(f"{key_prefix}:{key}")
+        return check_rate
+
+    def _prune(self):
+        # Buckets that have refilled carry no state worth keeping
+        now = time.monotonic()
+        for key, bucket in list(self._buckets.items()):
+            if bucket.tokens + (now - bucket.updated) * bucket.rate >= bucket.burst:
+                del self._buckets[key]
+
+    def stats(self):
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejectedQueueFull": self.rejected_queue_full,
+            "rejectedTimeout": self.rejected_timeout,
+            "rejectedRateLimited": self.rejected_rate_limited,
+        }
+
+
+ingest = AdmissionController(
+    max_concurrency=INGEST_MAX_CONCURRENCY,
+    max_queue=INGEST_MAX_QUEUE,
+    queue_timeout=INGEST_QUEUE_TIMEOUT_SECONDS,
+    rate=INGEST_RATE_PER_SECOND,
+    burst=INGEST_BURST,
+)
@@ -0,0 +1,355 @@
+import os
+import threading
+
+from array import array
+from bisect import bisect_right
+from collections import deque
+from datetime import datetime, time, timedelta
+
+from sqlalchemy.orm import Session
+
+import app.schemas as _schemas
+import app.services as _services
+import app.summaries as _summaries
+
+PERCENTILES = (10, 25, 50, 75, 90)
+
+# DailySummary fields, with motion as the total of all activities
+_FIELDS = ("motion",) + tuple(_summaries.ACTIVITY_FIELDS.values())
+_FIELD_INDEXES = {activity_id: _FIELDS.index(field) for activity_id, field in _summaries.ACTIVITY_FIELDS.items()}
+
+
+def _percentile(sorted_values, percentile: float):
+    # Linear interpolation between the closest ranks
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * percentile / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def _histogram(sorted_values, bins: int):
+    upper = sorted_values[-1] if sorted_values else 0.0
+    width = upper / bins if upper > 0 else 1.0
+    edges = [width * index for index in range(bins + 1)]
+    counts = [0] * bins
+    for value in sorted_values:
+        counts[min(int(value / width), bins - 1)] += 1
+    return edges, counts
+
+
+# Daily seconds per activity for every patient-day, one array of doubles per activity
+class PopulationAccumulator:
+    def __init__(self):
+        self.values = [array("d") for _ in _FIELDS]
+        self.patient_ids = set()
+
+    def add_rows(self, rows):
+        # rows are (patient_id, day, activity_id, seconds), ordered by patient and day
+        current_key = None
+        day_seconds = [0.0] * len(_FIELDS)
+        for patient_id, day, activity_id, seconds in rows:
+            if (patient_id, day) != current_key:
+                if current_key is not None:
+                    self._add_day(day_seconds)
+                current_key = (patient_id, day)
+                day_seconds = [0.0] * len(_FIELDS)
+                self.patient_ids.add(patient_id)
+            index = _FIELD_INDEXES.get(activity_id)
+            if index is None:
+                continue
+            day_seconds[index] += seconds or 0
+        if current_key is not None:
+            self._add_day(day_seconds)
+
+    def _add_day(self, day_seconds):
+        # Same int truncation per activity as the daily summaries
+        day_seconds = [float(int(seconds)) for seconds in day_seconds]
+        day_seconds[0] = sum(day_seconds[1:])
+        for values, seconds in zip(self.values, day_seconds):
+            values.append(seconds)
+
+    def distribution(self, index: int, bins: int, patient_mean=None):
+        sorted_values = sorted(self.values[index])
+        edges, counts = _histogram(sorted_values, bins)
+        return _schemas.ActivityDistribution(
+            count=len(sorted_values),
+            meanInSeconds=sum(sorted_values) / len(sorted_values) if sorted_values else 0.0,
+            percentilesInSeconds={f"p{percentile}": _percentile(sorted_values, percentile) for percentile in PERCENTILES},
+            histogramEdgesInSeconds=edges,
+            histogramCounts=counts,
+            patientMeanInSeconds=patient_mean,
+            patientPercentile=100 * bisect_right(sorted_values, patient_mean) / len(sorted_values) if patient_mean is not None and sorted_values else None,
+        )
+
+
+def compute_population_stats(db: Session, start_date: datetime, end_date: datetime, patient_ids=None, bins: int = 10, compare_patient_id: int = None):
+    start_datetime = datetime.combine(start_date.date(), time.min)
+    end_datetime = datetime.combine(end_date.date() + timedelta(days=1), time.min)
+
+    population = PopulationAccumulator()
+    population.add_rows(_services.iter_population_activity_seconds(db=db, start_datetime=start_datetime, end_datetime=end_datetime, patient_ids=patient_ids))
+
+    patient_means = [None] * len(_FIELDS)
+    if compare_patient_id is not None:
+        patient = PopulationAccumulator()
+        patient.add_rows(_services.iter_population_activity_seconds(db=db, start_datetime=start_datetime, end_datetime=end_datetime, patient_ids=[compare_patient_id]))
+        # Over the patient's days with recorded activity, like the population
+        patient_means = [sum(values) / len(values) if values else 0.0 for values in patient.values]
+
+    return _schemas.PopulationStats(
+        startDate=start_datetime.strftime("%Y-%m-%d"),
+        endDate=end_date.strftime("%Y-%m-%d"),
+        patientCount=len(population.patient_ids),
+        patientDays=len(population.values[0]),
+        **{field: population.distribution(index, bins, patient_means[index]) for index, field in enumerate(_FIELDS)}
+    )
+
+
+# Rolling trends
+TREND_WINDOWS = (7, 28)
+# Number of recent days kept per patient for the day-by-day series
+TREND_HISTORY_DAYS = int(os.environ.get("TREND_HISTORY_DAYS", "90"))
+
+_TARGETS_IN_SECONDS = {
+    "motion": _summaries.DAILY_MOTION_TARGET_IN_SECONDS,
+    "clapping": _summaries.DAILY_CLAPPING_TARGET_IN_SECONDS,
+}
+
+
+# Sum and count of days meeting the target over the last `size` values, updated in O(1) per day
+class RollingWindow:
+    def __init__(self, size: int, target=None):
+        self.size = size
+        self.target = target
+        self.values = deque()
+        self.total = 0.0
+        self.days_met = 0
+
+    def push(self, value: float):
+        if len(self.values) == self.size:
+            dropped = self.values.popleft()
+            self.total -= dropped
+            if self.target is not None and dropped >= self.target:
+                self.days_met -= 1
+        self.values.append(value)
+        self.total += value
+        if self.target is not None and value >= self.target:
+            self.days_met += 1
+
+    def replace(self, age: int, value: float):
+        # Replaces the value pushed `age` days ago
+        index = len(self.values) - 1 - age
+        previous = self.values[index]
+        self.values[index] = value
+        self.total += value - previous
+        if self.target is not None:
+            self.days_met += (value >= self.target) - (previous >= self.target)
+
+    @property
+    def average(self):
+        return self.total / len(self.values) if self.values else 0.0
+
+    @property
+    def adherence(self):
+        if self.target is None or not self.values:
+            return None
+        return self.days_met / len(self.values)
+
+
+def _trend_day_seconds(seconds_by_activity: dict):
+    # Same int truncation per activity as the daily summaries
+    day_seconds = [0.0] * len(_FIELDS)
+    for activity_id, seconds in seconds_by_activity.items():
+        index = _FIELD_INDEXES.get(activity_id)
+        if index is not None:
+            day_seconds[index] = float(int(seconds))
+    day_seconds[0] = sum(day_seconds[1:])
+    return day_seconds
+
+
+class TrendState:
+    def __init__(self, first_date):
+        self.lock = threading.Lock()
+        self.first_date = first_date
+        self.last_date = first_date - timedelta(days=1)
+        self.version = None
+        self.last_activityframe_id = 0
+        # Frames with an id up to last_activityframe_id that are already in the windows
+        self.activityframe_count = 0
+        self.windows = [{size: RollingWindow(size, _TARGETS_IN_SECONDS.get(field)) for size in TREND_WINDOWS} for field in _FIELDS]
+        self.days = 0
+        self.days_met = [0] * len(_FIELDS)
+        # One row of rolling averages per day, all windows of a field next to each other
+        self.history = deque(maxlen=TREND_HISTORY_DAYS)
+
+    def push_day(self, day, seconds_by_activity: dict):
+        day_seconds = _trend_day_seconds(seconds_by_activity)
+
+        averages = array("d")
+        for index, seconds in enumerate(day_seconds):
+            for window in self.windows[index].values():
+                window.push(seconds)
+                averages.append(window.average)
+            target = _TARGETS_IN_SECONDS.get(_FIELDS[index])
+            if target is not None and seconds >= target:
+                self.days_met[index] += 1
+        self.days += 1
+        self.history.append((day, averages))
+        self.last_date = day
+
+    def can_patch(self, day):
+        # Days still held by the largest window can be corrected in place
+        return self.first_date <= day and (self.last_date - day).days < len(self.windows[0][max(TREND_WINDOWS)].values)
+
+    def patch_day(self, day, seconds_by_activity: dict):
+        # Replaces the totals of a day already in the windows, in O(largest window) per field
+        age = (self.last_date - day).days
+        for index, seconds in enumerate(_trend_day_seconds(seconds_by_activity)):
+            windows = self.windows[index]
+            previous = windows[max(TREND_WINDOWS)].values[-1 - age]
+            if seconds == previous:
+                continue
+            for window in windows.values():
+                if age < len(window.values):
+                    window.replace(age, seconds)
+            target = _TARGETS_IN_SECONDS.get(_FIELDS[index])
+            if target is not None:
+                self.days_met[index] += (seconds >= target) - (previous >= target)
+
+            # The rolling averages of this day and the following days whose windows include it
+            for row_age, (_, averages) in enumerate(reversed(self.history)):
+                if row_age > age:
+                    break
+                for position, window in enumerate(windows.values()):
+                    if age - row_age < window.size:
+                        averages[index * len(TREND_WINDOWS) + position] += (seconds - previous) / min(window.size, self.days - row_age)
+
+
+class TrendCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._states = {}
+
+    def get(self, patient_id: int):
+        with self._lock:
+            return self._states.get(patient_id)
+
+    def put(self, patient_id: int, state: TrendState):
+        with self._lock:
+            self._states[patient_id] = state
+
+    def invalidate(self, patient_id: int):
+        with self._lock:
+            self._states.pop(patient_id, None)
+
+
+trends = TrendCache()
+
+
+def _build_trend_state(db: Session, patient_id: int):
+    first_date = _services.get_first_activity_date(db=db, patient_id=patient_id)
+    return TrendState(first_date) if first_date is not None else None
+
+
+def _extend_trend_state(db: Session, patient_id: int, state: TrendState, last_complete_date):
+    if state.last_date >= last_complete_date:
+        return
+    start_date = state.last_date + timedelta(days=1)
+    seconds_by_day = _services.get_activity_seconds_by_day(
+        db=db,
+        patient_id=patient_id,
+        start_datetime=datetime.combine(start_date, time.min),
+        end_datetime=datetime.combine(last_complete_date, time.max)
+    )
+    day = start_date
+    while day <= last_complete_date:
+        state.push_day(day, seconds_by_day.get(day.strftime("%Y-%m-%d"), {}))
+        day += timedelta(days=1)
+
+
+def _patch_trend_state(db: Session, patient_id: int, state: TrendState, start_date):
+    seconds_by_day = _services.get_activity_seconds_by_day(
+        db=db,
+        patient_id=patient_id,
+        start_datetime=datetime.combine(start_date, time.min),
+        end_datetime=datetime.combine(state.last_date, time.max)
+    )
+    day = start_date
+    while day <= state.last_date:
+        state.patch_day(day, seconds_by_day.get(day.strftime("%Y-%m-%d"), {}))
+        day += timedelta(days=1)
+
+
+def _apply_new_activityframes(db: Session, patient_id: int, state: TrendState, version: int):
+    # Frames ingested since the last update may belong to days already in the windows.
+    # Returns False when the state has to be rebuilt: frames already applied were deleted or archived,
+    # or the new frames are too old to patch.
+    if _services.count_activityframes(db=db, patient_id=patient_id, until_activityframe_id=state.last_activityframe_id) != state.activityframe_count:
+        return False
+    first_started, last_activityframe_id, new_activityframe_count = _services.get_new_activityframes_range(
+        db=db, patient_id=patient_id, after_activityframe_id=state.last_activityframe_id
+    )
+    if first_started is not None and first_started.date() <= state.last_date:
+        if not state.can_patch(first_started.date()):
+            return False
+        _patch_trend_state(db=db, patient_id=patient_id, state=state, start_date=first_started.date())
+    state.last_activityframe_id = last_activityframe_id or state.last_activityframe_id
+    state.activityframe_count += new_activityframe_count
+    state.version = version
+    return True
+
+
+def _trend_response(patient_id: int, state: TrendState, days: int):
+    activity_trends = {}
+    for index, field in enumerate(_FIELDS):
+        windows = state.windows[index]
+        has_target = field in _TARGETS_IN_SECONDS
+        activity_trends[field] = _schemas.ActivityTrend(
+            rollingAverage7InSeconds=windows[7].average,
+            rollingAverage28InSeconds=windows[28].average,
+            targetInSeconds=_TARGETS_IN_SECONDS.get(field),
+            adherence7=windows[7].adherence,
+            adherence28=windows[28].adherence,
+            adherenceAllTime=state.days_met[index] / state.days if has_target and state.days else None,
+        )
+
+    history = list(state.history)[-days:] if days else []
+    return _schemas.Trend(
+        patientId=patient_id,
+        firstDate=state.first_date.strftime("%Y-%m-%d"),
+        lastCompleteDate=state.last_date.strftime("%Y-%m-%d") if state.days else None,
+        days=[
+            _schemas.TrendDay(
+                date=day.strftime("%Y-%m-%d"),
+                rollingAverage7InSeconds={field: averages[index * len(TREND_WINDOWS)] for index, field in enumerate(_FIELDS)},
+                rollingAverage28InSeconds={field: averages[index * len(TREND_WINDOWS) + 1] for index, field in enumerate(_FIELDS)},
+            )
+            for day, averages in history
+        ],
+        **activity_trends
+    )
+
+
+def get_trend(db: Session, patient_id: int, days: int):
+    # Only complete days go into the windows; today is still being synced
+    last_complete_date = datetime.utcnow().date() - timedelta(days=1)
+    version = _services.get_patient_data_version(db=db, patient_id=patient_id)
+
+    state = trends.get(patient_id)
+    if state is not None:
+        with state.lock:
+            if state.version == version or _apply_new_activityframes(db=db, patient_id=patient_id, state=state, version=version):
+                _extend_trend_state(db=db, patient_id=patient_id, state=state, last_complete_date=last_complete_date)
+                return _trend_response(patient_id, state, days)
+
+    # No state yet, or changes that cannot be patched in: start over from the first day
+    state = _build_trend_state(db=db, patient_id=patient_id)
+    if state is None:
+        return _schemas.Trend(patientId=patient_id, firstDate=None, lastCompleteDate=None, days=[], **{field: _schemas.ActivityTrend(targetInSeconds=_TARGETS_IN_SECONDS.get(field)) for field in _FIELDS})
+    with state.lock:
+        _apply_new_activityframes(db=db, patient_id=patient_id, state=state, version=version)
+        _extend_trend_state(db=db, patient_id=patient_id, state=state, last_complete_date=last_complete_date)
+        trends.put(patient_id, state)
+        return _trend_response(patient_id, state, days)
@@ -1,13 +1,39 @@
+import os as _os
+
 import sqlalchemy as _sql
 import sqlalchemy.ext.declarative as _declarative
 import sqlalchemy.orm as _orm
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./database.db"
 
+# GET endpoints read from a replica when one is configured, otherwise from the same
+# SQLite file opened read-only through a separate pool
+SQLALCHEMY_READ_DATABASE_URL = _os.environ.get("READ_DATABASE_URL", "sqlite:///file:./database.db?mode=ro&uri=true")
+
+# Closed months of activity frames are exported into one SQLite file per month in this directory
+ARCHIVE_DIRECTORY = _os.environ.get("ARCHIVE_DIRECTORY", "./archive")
+
 engine = _sql.create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
 
+read_engine = _sql.create_engine(
+    SQLALCHEMY_READ_DATABASE_URL,
+    connect_args={"check_same_thread": False} if SQLALCHEMY_READ_DATABASE_URL.startswith("sqlite") else {}
+)
+
+@_sql.event.listens_for(engine, "connect")
+def _enable_wal(dbapi_connection, connection_record):
+    # In WAL mode readers do not block the writer and the writer does not block readers
+    dbapi_connection.execute("PRAGMA journal_mode=WAL")
+
+if read_engine.dialect.name == "sqlite":
+    @_sql.event.listens_for(read_engine, "connect")
+    def _set_query_only(dbapi_connection, connection_record):
+        dbapi_connection.execute("PRAGMA query_only = ON")
+
 SessionLocal = _orm.sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+ReadSessionLocal = _orm.sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
 Base = _declarative.declarative_base()
\ No newline at end of file
@@ -0,0 +1,161 @@
+import asyncio
+import json
+import logging
+import os
+
+from datetime import datetime, time
+
+from fastapi import WebSocket
+from sqlalchemy.orm import Session
+
+import app.services as _services
+import app.summaries as _summaries
+
+# Updates for a subscriber are held back this long so bursts of ingest are sent as one message
+COALESCE_SECONDS = float(os.environ.get("LIVE_COALESCE_SECONDS", "1.0"))
+# A subscriber that does not accept a message within this time is dropped
+SEND_TIMEOUT_SECONDS = float(os.environ.get("LIVE_SEND_TIMEOUT_SECONDS", "5.0"))
+# A subscriber with more unsent (patient, day) updates than this is dropped
+MAX_PENDING_UPDATES = int(os.environ.get("LIVE_MAX_PENDING_UPDATES", "1000"))
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    def __init__(self, patient_ids):
+        self.patient_ids = set(patient_ids)
+        # (patient_id, date) -> {field: seconds}
+        self.pending = {}
+        self.ready = asyncio.Event()
+        self.dropped = False
+
+
+class SummaryHub:
+    def __init__(self):
+        self._loop = None
+        # patient_id -> set of subscriptions
+        self._subscriptions = {}
+
+    def attach(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+
+    def subscribe(self, subscription: Subscription):
+        for patient_id in subscription.patient_ids:
+            self._subscriptions.setdefault(patient_id, set()).add(subscription)
+
+    def unsubscribe(self, subscription: Subscription):
+        for patient_id in subscription.patient_ids:
+            subscriptions = self._subscriptions.get(patient_id)
+            if subscriptions is None:
+                continue
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscriptions[patient_id]
+
+    def resubscribe(self, subscription: Subscription, patient_ids):
+        self.unsubscribe(subscription)
+        subscription.patient_ids = set(patient_ids)
+        self.subscribe(subscription)
+
+    def publish(self, db: Session, patient_id: int, activityframes):
+        # Called from the threadpool after ingest has committed the frames
+        if self._loop is None or patient_id not in self._subscriptions:
+            return
+
+        # Frames that run past midnight do not count toward any daily summary
+        days = {activityframe.date_started.date() for activityframe in activityframes if activityframe.date_started.date() == activityframe.date_finished.date()}
+        if not days:
+            return
+
+        # Deltas are the change of the truncated totals /daily-summary shows. The ids of one ingest are
+        # contiguous, so the totals up to just before and just after them bracket exactly this ingest.
+        activityframe_ids = [activityframe.id for activityframe in activityframes]
+        start_datetime = datetime.combine(min(days), time.min)
+        end_datetime = datetime.combine(max(days), time.max)
+        seconds_before = _services.get_activity_seconds_by_day(
+            db=db, patient_id=patient_id, start_datetime=start_datetime, end_datetime=end_datetime, until_activityframe_id=min(activityframe_ids) - 1
+        )
+        seconds_after = _services.get_activity_seconds_by_day(
+            db=db, patient_id=patient_id, start_datetime=start_datetime, end_datetime=end_datetime, until_activityframe_id=max(activityframe_ids)
+        )
+
+        deltas = {}
+        for day in days:
+            day_key = day.strftime("%Y-%m-%d")
+            before, after = seconds_before.get(day_key, {}), seconds_after.get(day_key, {})
+            for activity_id, field in _summaries.ACTIVITY_FIELDS.items():
+                seconds = int(after.get(activity_id, 0)) - int(before.get(activity_id, 0))
+                if seconds:
+                    deltas.setdefault(day_key, {})[field] = seconds
+
+        if deltas:
+            self._loop.call_soon_threadsafe(self._deliver, patient_id, deltas)
+
+    def _deliver(self, patient_id: int, deltas: dict):
+        for subscription in self._subscriptions.get(patient_id, ()):
+            for day, day_deltas in deltas.items():
+                pending = subscription.pending.setdefault((patient_id, day), {})
+                for field, seconds in day_deltas.items():
+                    pending[field] = pending.get(field, 0) + seconds
+            if len(subscription.pending) > MAX_PENDING_UPDATES:
+                subscription.dropped = True
+            subscription.ready.set()
+
+    async def _send_updates(self, websocket: WebSocket, subscription: Subscription):
+        while True:
+            await subscription.ready.wait()
+            await asyncio.sleep(COALESCE_SECONDS)
+            if subscription.dropped:
+                return
+
+            subscription.ready.clear()
+            pending, subscription.pending = subscription.pending, {}
+
+            updates = []
+            for (patient_id, day), day_deltas in pending.items():
+                deltas = dict(day_deltas)
+                deltas["motion"] = sum(day_deltas.values())
+                updates.append({"patientId": patient_id, "date": day, "deltas": deltas})
+
+            try:
+                await asyncio.wait_for(websocket.send_json({"updates": updates}), SEND_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                return
+
+    async def _receive_subscriptions(self, websocket: WebSocket, subscription: Subscription):
+        # Clients may change their subscription by sending {"patientIds": [...]}
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            if message.get("text") is None:
+                # Binary messages are not part of the protocol
+                await websocket.close(code=1003)
+                return
+            try:
+                message = json.loads(message["text"])
+            except ValueError:
+                continue
+            patient_ids = message.get("patientIds") if isinstance(message, dict) else None
+            if isinstance(patient_ids, list) and all(isinstance(patient_id, int) for patient_id in patient_ids):
+                self.resubscribe(subscription, patient_ids)
+
+    async def serve(self, websocket: WebSocket, patient_ids):
+        subscription = Subscription(patient_ids)
+        self.subscribe(subscription)
+        sender = asyncio.create_task(self._send_updates(websocket, subscription))
+        receiver = asyncio.create_task(self._receive_subscriptions(websocket, subscription))
+        try:
+            done, _ = await asyncio.wait([sender, receiver], return_when=asyncio.FIRST_COMPLETED)
+            if sender in done and sender.exception() is None:
+                # Slow consumer, close with "try again later"
+                await websocket.close(code=1013)
+            if receiver in done and receiver.exception() is not None:
+                logger.warning("Live subscription closed by a receive error: %r", receiver.exception())
+        finally:
+            self.unsubscribe(subscription)
+            sender.cancel()
+            receiver.cancel()
+
+
+hub = SummaryHub()
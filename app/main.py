@@ -1,12 +1,20 @@
-from fastapi import Path, Query, FastAPI, Depends, HTTPException
+from fastapi import Path, Query, FastAPI, Depends, HTTPException, Request, Response, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 from datetime import datetime, time, timedelta, timezone
 
+import asyncio
+import hashlib
 import uvicorn
+import app.admission as _admission
+import app.analytics as _analytics
+import app.live as _live
+import app.registry as _registry
+import app.scheduler as _scheduler
 import app.schemas as _schemas
 import app.services as _services
+import app.summaries as _summaries
 
 app = FastAPI()
 
@@ -22,15 +30,54 @@ app.add_middleware(
 
 _services.create_database()
 
+@app.on_event("startup")
+def warm_device_registry():
+    _services.warm_device_registry()
+
+@app.on_event("startup")
+async def attach_live_hub():
+    _live.hub.attach(asyncio.get_running_loop())
+
+@app.on_event("startup")
+async def start_summary_scheduler():
+    if _scheduler.PRECOMPUTE_ENABLED:
+        _scheduler.scheduler.start()
+
+@app.on_event("shutdown")
+async def stop_summary_scheduler():
+    await _scheduler.scheduler.stop()
+
+# Conditional GET for patient data: caches may store responses but have to revalidate them with the ETag
+PATIENT_DATA_CACHE_CONTROL = "no-cache"
+
+def _patient_data_etag(request: Request, patient_id: int, version: int):
+    digest = hashlib.sha1(f"{request.url.path}?{request.url.query}".encode()).hexdigest()[:16]
+    return f'"{patient_id}-{version}-{digest}"'
+
+def _etag_matches(request: Request, etag: str):
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip().removeprefix("W/") for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+def _set_cache_headers(response: Response, etag: str):
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = PATIENT_DATA_CACHE_CONTROL
+
+def _not_modified(etag: str):
+    response = Response(status_code=304)
+    _set_cache_headers(response, etag)
+    return response
+
 # Endpoints for testing
-@app.post("/multiple_activityframes/", tags=["Active Testing"], response_model=List[_schemas.ActivityFrame])
-def create_multiple_activityframes(requestData: _schemas.ActivityFrameRequest, db: Session = Depends(_services.get_db)):
-    created_activityframes = []
+def _parse_device_data(currentTime: datetime, deviceTime: int, dataFromDevice: str, patient_id: int):
+    activityframes = []
 
-    deviceEnabledTime = requestData.currentTime - timedelta(milliseconds=requestData.deviceTime)
+    deviceEnabledTime = currentTime - timedelta(milliseconds=deviceTime)
 
     # Split the data from the device, and group the values into sets of (activity_id, time_started, time_finished)
-    values = requestData.dataFromDevice.split(";")
+    values = dataFromDevice.split(";")
 
     # Clean the data by removing anything that isn't a number or ;
     cleaned_values = [value for value in values if value.isdigit() or value == ";"]
@@ -54,23 +101,61 @@ def create_multiple_activityframes(requestData: _schemas.ActivityFrameRequest, d
 
         # Create a dictionary with data for a single activity frame
         activityFrameData = {
-            "patient_id": requestData.patientId,
+            "patient_id": patient_id,
             "activity_id": group[0],
             "date_started": date_started,
             "date_finished": date_finished
         }
 
         # Create an ActivityFrameCreate instance from the dictionary
-        activityframe = _schemas.ActivityFrameCreate(**activityFrameData)
+        activityframes.append(_schemas.ActivityFrameCreate(**activityFrameData))
+
+    return activityframes
 
-        # Call the service function to create the activity frame in the database
-        created_frame = _services.create_activityframe(db=db, activityframe=activityframe)
-        created_activityframes.append(created_frame)
+@app.post("/multiple_activityframes/", tags=["Active Testing"], response_model=List[_schemas.ActivityFrame], dependencies=[Depends(_admission.ingest.rate_limit("patient", "patientId")), Depends(_admission.ingest.admit)])
+def create_multiple_activityframes(requestData: _schemas.ActivityFrameRequest, db: Session = Depends(_services.get_db)):
+    activityframes = _parse_device_data(requestData.currentTime, requestData.deviceTime, requestData.dataFromDevice, requestData.patientId)
+
+    # Call the service function to create the activity frames in the database
+    created_activityframes = _services.create_activityframes(db=db, activityframes=activityframes)
+
+    _live.hub.publish(db, requestData.patientId, created_activityframes)
+    return created_activityframes
+
+# Same as /multiple_activityframes/, but the patient is resolved from the MAC address of the device
+@app.post("/device_activityframes/", tags=["Active Testing"], response_model=List[_schemas.ActivityFrame], dependencies=[Depends(_admission.ingest.rate_limit("device", "macAddress")), Depends(_admission.ingest.admit)])
+def create_device_activityframes(requestData: _schemas.DeviceActivityFrameRequest, db: Session = Depends(_services.get_db)):
+    device = _registry.devices.resolve(db=db, mac_address=requestData.macAddress)
+    if device is None:
+        raise HTTPException(
+            status_code=404, detail="Device not found"
+        )
+    device_id, patient_id = device
+    if patient_id is None:
+        raise HTTPException(
+            status_code=409, detail="Device is not assigned to a patient"
+        )
+
+    activityframes = _parse_device_data(requestData.currentTime, requestData.deviceTime, requestData.dataFromDevice, patient_id)
+    created_activityframes = _services.create_activityframes(db=db, activityframes=activityframes)
 
+    _live.hub.publish(db, patient_id, created_activityframes)
     return created_activityframes
 
+# Pushes per-activity deltas of the daily summaries of the subscribed patients as frames are ingested
+@app.websocket("/live/daily-summary/")
+async def live_daily_summary(websocket: WebSocket, patient_ids: List[int] = Query([])):
+    await websocket.accept()
+    await _live.hub.serve(websocket, patient_ids)
+
 @app.get("/activityframes/{patient_id}/date/{activity_date}", tags=["Active Testing"], response_model=List[_schemas.ActivityFrame])
-def get_activityframes_for_date(patient_id: int, activity_date: datetime, db: Session = Depends(_services.get_db)):
+def get_activityframes_for_date(patient_id: int, activity_date: datetime, request: Request, response: Response, db: Session = Depends(_services.get_read_db)):
+    version = _services.get_patient_data_version(db=db, patient_id=patient_id)
+    etag = _patient_data_etag(request, patient_id, version)
+    if _etag_matches(request, etag):
+        return _not_modified(etag)
+    _set_cache_headers(response, etag)
+
     # Assuming you store both `date_started` and `date_finished` in UTC
     start_datetime = datetime.combine(activity_date, time.min).replace(tzinfo=timezone.utc)
     end_datetime = datetime.combine(activity_date, time.max).replace(tzinfo=timezone.utc)
@@ -79,148 +164,33 @@ def get_activityframes_for_date(patient_id: int, activity_date: datetime, db: Se
     return activityframes
 
 @app.get("/daily-summary/{patient_id}/date/{activity_date}", tags=["Active Testing"], response_model=_schemas.DailySummary)
-def get_daily_summary(patient_id: int, activity_date: datetime, db: Session = Depends(_services.get_db)):
-    # Get all activity frames for the specified patient and date
-    start_datetime = datetime.combine(activity_date, time.min).replace(tzinfo=timezone.utc)
-    end_datetime = datetime.combine(activity_date, time.max).replace(tzinfo=timezone.utc)
-    activityframes = _services.get_activityframes_for_patient_and_date(db=db, patient_id=patient_id, start_datetime=start_datetime, end_datetime=end_datetime)
-
-    # Initialize variables to store the duration of each activity
-    time_on_random = 0
-    time_on_clapping = 0
-    time_on_brushing_teeth = 0
-    time_on_washing_hands = 0
-    time_on_combing_hair = 0
-
-    # Iterate through each activity frame and calculate the duration for each activity
-    for activityframe in activityframes:
-        activity_id = activityframe.activity_id
-        duration = (activityframe.date_finished - activityframe.date_started).total_seconds()
-
-        if activity_id == 0:
-            time_on_random += duration
-        elif activity_id == 1:
-            time_on_clapping += duration
-        elif activity_id == 2:
-            time_on_brushing_teeth += duration
-        elif activity_id == 3:
-            time_on_washing_hands += duration
-        elif activity_id == 4:
-            time_on_combing_hair += duration
-
-    # Create and return the Summary instance
-    summary = _schemas.DailySummary(
-        date=activity_date.strftime("%Y-%m-%d"),
-        motion=_schemas.ActivityDuration(
-            activityDurationInSeconds=int(time_on_clapping) + int(time_on_brushing_teeth) + int(time_on_combing_hair) + int(time_on_washing_hands) + int(time_on_random),
-            activityTargetInSeconds=75*60
-        ),
-        clapping=_schemas.ActivityDuration(
-            activityDurationInSeconds=int(time_on_clapping),
-            activityTargetInSeconds=15*60
-        ),
-        brushingTeeth=_schemas.ActivityDuration(
-            activityDurationInSeconds=int(time_on_brushing_teeth),
-            activityTargetInSeconds=None
-        ),
-        brushingHair=_schemas.ActivityDuration(
-            activityDurationInSeconds=int(time_on_combing_hair),
-            activityTargetInSeconds=None
-        ),
-        cleaningHands=_schemas.ActivityDuration(
-            activityDurationInSeconds=int(time_on_washing_hands),
-            activityTargetInSeconds=None
-        ),
-        randomMotion=_schemas.ActivityDuration(
-            activityDurationInSeconds=int(time_on_random),
-            activityTargetInSeconds=None
-        ),
-    )
+def get_daily_summary(patient_id: int, activity_date: datetime, request: Request, response: Response, db: Session = Depends(_services.get_read_db)):
+    version = _services.get_patient_data_version(db=db, patient_id=patient_id)
+    etag = _patient_data_etag(request, patient_id, version)
+    if _etag_matches(request, etag):
+        return _not_modified(etag)
+    _set_cache_headers(response, etag)
 
-    return summary
+    return _summaries.get_daily_summary(db=db, patient_id=patient_id, activity_date=activity_date, version=version)
 
 @app.get("/monthly-summary/{patient_id}/month/{activity_month}", tags=["Active Testing"], response_model=_schemas.MonthlySummary)
-def get_monthly_summary(patient_id: int, activity_month: datetime, db: Session = Depends(_services.get_db)):
-    # Calculate the start_date (first day of the month) and end_date (last day of the month)
-    start_date = datetime.combine(activity_month.replace(day=1), time.min).replace(tzinfo=timezone.utc)
-    next_month = (activity_month.replace(day=28) + timedelta(days=4)).replace(day=1)
-    end_date = (next_month - timedelta(days=1)).replace(hour=23, minute=59, second=59).replace(tzinfo=timezone.utc)
-
-    # Get all activity frames for the specified patient and date range
-    activityframes = _services.get_activityframes_for_patient_and_date(db=db, patient_id=patient_id, start_datetime=start_date, end_datetime=end_date)
-
-    # Initialize a list to store daily summaries
-    monthly_summaries = []
-
-    # Iterate through each day in the month and create a daily summary
-    current_date = start_date
-    while current_date <= end_date:
-        # Initialize variables to store the duration of each activity for the current day
-        time_on_random = 0
-        time_on_clapping = 0
-        time_on_brushing_teeth = 0
-        time_on_washing_hands = 0
-        time_on_combing_hair = 0
-
-        # Iterate through each activity frame for the current day and calculate the duration for each activity
-        for activityframe in activityframes:
-            if current_date.date() == activityframe.date_started.date():
-                activity_id = activityframe.activity_id
-                duration = (activityframe.date_finished - activityframe.date_started).total_seconds()
+def get_monthly_summary(patient_id: int, activity_month: datetime, request: Request, response: Response, db: Session = Depends(_services.get_read_db)):
+    version = _services.get_patient_data_version(db=db, patient_id=patient_id)
+    etag = _patient_data_etag(request, patient_id, version)
+    if _etag_matches(request, etag):
+        return _not_modified(etag)
+    _set_cache_headers(response, etag)
 
-                if activity_id == 0:
-                    time_on_random += duration
-                elif activity_id == 1:
-                    time_on_clapping += duration
-                elif activity_id == 2:
-                    time_on_brushing_teeth += duration
-                elif activity_id == 3:
-                    time_on_washing_hands += duration
-                elif activity_id == 4:
-                    time_on_combing_hair += duration
-
-        # Create and append the daily summary
-        daily_summary = _schemas.DailySummary(
-            date=current_date.strftime("%Y-%m-%d"),
-            motion=_schemas.ActivityDuration(
-                activityDurationInSeconds=int(time_on_clapping) + int(time_on_brushing_teeth) + int(
-                    time_on_combing_hair) + int(time_on_washing_hands) + int(time_on_random),
-                #  TODO: change 600
-                activityTargetInSeconds=600
-            ),
-            clapping=_schemas.ActivityDuration(
-                activityDurationInSeconds=int(time_on_clapping),
-                activityTargetInSeconds=None
-            ),
-            brushingTeeth=_schemas.ActivityDuration(
-                activityDurationInSeconds=int(time_on_brushing_teeth),
-                activityTargetInSeconds=None
-            ),
-            brushingHair=_schemas.ActivityDuration(
-                activityDurationInSeconds=int(time_on_combing_hair),
-                activityTargetInSeconds=None
-            ),
-            cleaningHands=_schemas.ActivityDuration(
-                activityDurationInSeconds=int(time_on_washing_hands),
-                activityTargetInSeconds=None
-            ),
-            randomMotion=_schemas.ActivityDuration(
-                activityDurationInSeconds=int(time_on_random),
-                activityTargetInSeconds=None
-            ),
-        )
-        monthly_summaries.append(daily_summary)
-
-        # Move to the next day
-        current_date += timedelta(days=1)
-
-    # Create and return the MonthlySummary instance
-    monthly_summary = _schemas.MonthlySummary(monthlySummaries=monthly_summaries)
-
-    return monthly_summary
+    return _summaries.get_monthly_summary(db=db, patient_id=patient_id, activity_month=activity_month, version=version)
 
 @app.get("/monthly_summaries/", tags=["Active Testing"], response_model=_schemas.MonthlySummary)
-def get_monthly_summaries(patient_id: int, activity_month: datetime, db: Session = Depends(_services.get_db)):
+def get_monthly_summaries(patient_id: int, activity_month: datetime, request: Request, response: Response, db: Session = Depends(_services.get_read_db)):
+    version = _services.get_patient_data_version(db=db, patient_id=patient_id)
+    etag = _patient_data_etag(request, patient_id, version)
+    if _etag_matches(request, etag):
+        return _not_modified(etag)
+    _set_cache_headers(response, etag)
+
     # Replace the provided JSON with your actual data
     data_by_month = {
     "2023-09": [{"date":"2023-09-01","motion":{"activityDurationInSeconds":3800,"activityTargetInSeconds":3600},"clapping":{"activityDurationInSeconds":580,"activityTargetInSeconds":300},"brushingTeeth":{"activityDurationInSeconds":120,"activityTargetInSeconds":None},"brushingHair":{"activityDurationInSeconds":70,"activityTargetInSeconds":120},"cleaningHands":{"activityDurationInSeconds":110,"activityTargetInSeconds":None},"randomMotion":{"activityDurationInSeconds":2920,"activityTargetInSeconds":None}},{"date":"2023-09-02","motion":{"activityDurationInSeconds":4000,"activityTargetInSeconds":3600},"clapping":{"activityDurationInSeconds":660,"activityTargetInSeconds":300},"brushingTeeth":{"activityDurationInSeconds":420,"activityTargetInSeconds":None},"brushingHair":{"activityDurationInSeconds":320,"activityTargetInSeconds":None},"cleaningHands":{"activityDurationInSeconds":270,"activityTargetInSeconds":None},"randomMotion":{"activityDurationInSeconds":2330,"activityTargetInSeconds":None}},{"date":"2023-09-03","motion":{"activityDurationInSeconds":3800,"activityTargetInSeconds":3600},"clapping":{"activityDurationInSeconds":500,"activityTargetInSeconds":300},"brushingTeeth":{"activityDurationInSeconds":0,"activityTargetInSeconds":None},"brushingHair":{"activityDurationInSeconds":240,"activityTargetInSeconds":120},"cleaningHands":{"activityDurationInSeconds":140,"activityTargetInSeconds":None},"randomMotion":{"activityDurationInSeconds":2920,"activityTargetInSeconds":None}},{"date":"2023-09-04","motion":{"activityDurationInSeconds":4300,"activityTargetInSeconds":3600},"clapping":{"activityDurationInSeconds":460,"activityTargetInSeconds":300},"brushingTeeth":{"activityDurationInSeconds":60,"activityTargetInSeconds":None},"brushingHair":{"activityDurationInSeconds":120,"activityTargetInSeconds":None},"cleaningHands":{"activityDurationInSeconds":220,"activityTargetInSeconds":None},"randomMotion":{"activityDurationInSeconds":3440,"activityTargetInSeconds":None}},{"date":"2023-09-05","motion":{"activityDurationInSeconds":4500,"activityTargetInSeconds":3600},"clapping":{"activityDurationInSeconds":540,"activityTargetInSeconds":300},"brushingTeeth":{"activityDurationInSeconds":200,"activityTargetInSeconds":None},"brushingHair":{"activityDurationInSeconds":240,"activityTargetInSeconds":None},"cleaningHands":{"activityDurationInSeconds":150,"activityTargetInSeconds":None},"randomMotion":{"activityDurationInSeconds":3370,"activityTargetInSeconds":None}},{"date":"2023-09-06","motion":{"activityDurationInSeconds":4500,"activityTargetInSeconds":3600},"clapping":{"activityDurationInSeconds":460,"activityTargetInSeconds":300},"brushingTeeth":{"activityDurationInSeconds":180,"activityTargetInSeconds":None},"brushingHair":{"activityDurationInSeconds":180,"activityTargetInSeconds":None},"cleaningHands":{"activityDurationInSeconds":160,"activityTargetInSeconds":None},"randomMotion":{"activityDurationInSeconds":3520,"activityTargetInSeconds":None}},{"date":"2023-09-07","motion":{"activityDurationInSeconds":3700,"activityTargetInSeconds":3600},"clapping":{"activityDurationInSeconds":640,"activityTargetInSeconds":300},"brushingTeeth":{"activityDurationInSeconds":240,"activityTargetInSeconds":None},"brushingHair":{"activityDurationInSeconds":160,"activityTargetInSeconds":None},"cleaningHands":{"activityDurationInSeconds":220,"activityTargetInSeconds":None},"randomMotion":{"activityDurationInSeconds":2440,"activityTargetInSeconds":None}},{"date":"2023-09-08","motion":{"activityDurationInSeconds":4900,"activityTargetInSeconds":3600},"clapping":{"activityDurationInSeconds":720,"activityTargetInSeconds":300},"brushingTeeth":{"activityDurationInSeconds":220,"activityTargetInSeconds":None},"brushingHair":{"activityDurationInSeconds":170,"activityTargetInSeconds":None},"cleaningHands":{"activityDurationInSeconds":250,"activityTargetInSeconds":None},"randomMotion":{"activityDurationInSeconds":3540,"activityTargetInSeconds":None}},{"date":"2023-09-09","motion":{"activityDurationInSeconds":5400,"activityTargetInSeconds":3600},"clapping":{"activityDurationInSeconds":620,"activityTargetInSeconds":300},"brushingTeeth":{"activityDurationInSeconds":180,"activityTargetInSeconds":None},"brushingHair":{"activityDurationInSeconds":130,"activityTargetInSeconds":None},"cleaningHands":{"activityDurationInSeconds":270,"activityTargetInSeconds":None},"randomMotion":{"activityDurationInSeconds":4200,"activityTargetInSeconds":None}},{"date":"2023-09-10","motion":{"activityDurationInSeconds":5000,"activityTargetInSeconds":3600},"clapping":{"activityDurationInSeconds":460,"activityTargetInSeconds":300},"brushingTeeth":{"activityDurationInSeconds":240,"activityTargetInSeconds":None},"brushingHair":{"activityDurationInSeconds":240,"activityTargetInSeconds":None},"cleaningHands":{"activityDurationInSeconds":220,"activityTargetInSeconds":None},"randomMotion":{"activityDurationInSeconds":3840,"activityTargetInSeconds":None}},{"date":"2023-09-11","motion":{"activityDurationInSeconds":4200,"activityTargetInSeconds":3600},"clapping":{"activityDurationInSeconds":560,"activityTargetInSeconds":300},"brushingTeeth":{"activityDurationInSeconds":60,"activityTargetInSeconds":None},"brushingHair":{"activityDurationInSeconds":120,"activityTargetInSeconds":None},"cleaningHands":{"activityDurationInSeconds":160,"activityTargetInSeconds":None},"randomMotion":{"activityDurationInSeconds":3300,"activityTargetInSeconds":None}},{"date":"2023-09-12","motion":{"activityDurationInSeconds":5000,"activityTargetInSeconds":3600},"clapping":{"activityDurationInSeconds":740,"activityTargetInSeconds":300},"brushingTeeth":{"activityDurationInSeconds":100,"activityTargetInSeconds":None},"brushingHair":{"activityDurationInSeconds":230,"activityTargetInSeconds":None},"cleaningHands":{"activityDurationInSeconds":220,"activityTargetInSeconds":None},"randomMotion":{"activityDurationInSeconds":3710,"activityTargetInSeconds":None}},{"date":"2023-09-13","motion":{"activityDurationInSeconds":4000,"activityTargetInSeconds":3600},"clapping":{"activityDurationInSeconds":640,"activityTargetInSeconds":300},"brushingTeeth":{"activityDurationInSeconds":100,"activityTargetInSeconds":None},"brushingHair":{"activityDurationInSeconds":190,"activityTargetInSeconds":None},"cleaningHands":{"activityDurationInSeconds":220,"activityTargetInSeconds":None},"randomMotion":{"activityDurationInSeconds":2850,"activityTargetInSeconds":None}},{"date":"2023-09-14","motion":{"activityDurationInSeconds":4500,"activityTargetInSeconds":3600},"clapping":{"activityDurationInSeconds":740,"activityTargetInSeconds":300},"brushingTeeth":{"activityDurationInSeconds":220,"activityTargetInSeconds":None},"brushingHair":{"activityDurationInSeconds":160,"activityTargetInSeconds":None},"cleaningHands":{"activityDurationInSeconds":240,"activityTargetInSeconds":None},"randomMotion":{"activityDurationInSeconds":3140,"activityTargetInSeconds":None}},{"date":"2023-09-15","motion":{"activityDurationInSeconds":4200,"activityTargetInSeconds":3600},"clapping":{"activityDurationInSeconds":720,"activityTargetInSeconds":300},"brushingTeeth":{"activityDurationInSeconds":240,"activityTargetInSeconds":None},"brushingHair":{"activityDurationInSeconds":190,"activityTargetInSeconds":None},"cleaningHands":{"activityDurationInSeconds":240,"activityTargetInSeconds":None},"randomMotion":{"activityDurationInSeconds":2810,"activityTargetInSeconds":None}},{"date":"2023-09-16","motion":{"activityDurationInSeconds":4000,"activityTargetInSeconds":3600},"clapping":{"activityDurationInSeconds":740,"activityTargetInSeconds":300},"brushingTeeth":{"activityDurationInSeconds":60,"activityTargetInSeconds":None},"brushingHair":{"activityDurationInSeconds":150,"activityTargetInSeconds":None},"cleaningHands":{"activityDurationInSeconds":250,"activityTargetInSeconds":None},"randomMotion":{"activityDurationInSeconds":2800,"activityTargetInSeconds":None}},{"date":"2023-09-17","motion":{"activityDurationInSeconds":4000,"activityTargetInSeconds":3600},"clapping":{"activityDurationInSeconds":700,"activityTargetInSeconds":300},"brushingTeeth":{"activityDurationInSeconds":60,"activityTargetInSeconds":None},"brushingHair":{"activityDurationInSeconds":240,"activityTargetInSeconds":None},"cleaningHands":{"activityDurationInSeconds":200,"activityTargetInSeconds":None},"randomMotion":{"activityDurationInSeconds":2800,"activityTargetInSeconds":None}},{"date":"2023-09-18","motion":{"activityDurationInSeconds":4200,"activityTargetInSeconds":3600},"clapping":{"activityDurationInSeconds":820,"activityTargetInSeconds":300},"brushingTeeth":{"activityDurationInSeconds":240,"activityTargetInSeconds":None},"brushingHair":{"activityDurationInSeconds":240,"activityTargetInSeconds":None},"cleaningHands":{"activityDurationInSeconds":300,"activityTargetInSeconds":None},"randomMotion":{"activityDurationInSeconds":2600,"activityTargetInSeconds":None}},{"date":"2023-09-19","motion":{"activityDurationInSeconds":4300,"activityTargetInSeconds":3600},"clapping":{"activityDurationInSeconds":460,"activityTargetInSeconds":300},"brushingTeeth":{"activityDurationInSeconds":60,"activityTargetInSeconds":None},"brushingHair":{"activityDurationInSeconds":180,"activityTargetInSeconds":None},"cleaningHands":{"activityDurationInSeconds":150,"activityTargetInSeconds":None},"randomMotion":{"activityDurationInSeconds":3450,"activityTargetInSeconds":None}},{"date":"2023-09-20","motion":{"activityDurationInSeconds":4200,"activityTargetInSeconds":3600},"clapping":{"activityDurationInSeconds":660,"activityTargetInSeconds":300},"brushingTeeth":{"activityDurationInSeconds":100,"activityTargetInSeconds":None},"brushingHair":{"activityDurationInSeconds":240,"activityTargetInSeconds":None},"cleaningHands":{"activityDurationInSeconds":170,"activityTargetInSeconds":None},"randomMotion":{"activityDurationInSeconds":3030,"activityTargetInSeconds":None}},{"date":"2023-09-21","motion":{"activityDurationInSeconds":3600,"activityTargetInSeconds":4200},"clapping":{"activityDurationInSeconds":760,"activityTargetInSeconds":300},"brushingTeeth":{"activityDurationInSeconds":120,"activityTargetInSeconds":None},"brushingHair":{"activityDurationInSeconds":180,"activityTargetInSeconds":None},"cleaningHands":{"activityDurationInSeconds":180,"activityTargetInSeconds":None},"randomMotion":{"activityDurationInSeconds":2360,"activityTargetInSeconds":None}},{"date":"2023-09-22","motion":{"activityDurationInSeconds":3800,"activityTargetInSeconds":4200},"clapping":{"activityDurationInSeconds":980,"activityTargetInSeconds":300},"brushingTeeth":{"activityDurationInSeconds":240,"activityTargetInSeconds":None},"brushingHair":{"activityDurationInSeconds":180,"activityTargetInSeconds":None},"cleaningHands":{"activityDurationInSeconds":160,"activityTargetInSeconds":None},"randomMotion":{"activityDurationInSeconds":2240,"activityTargetInSeconds":None}},{"date":"2023-09-23","motion":{"activityDurationInSeconds":4000,"activityTargetInSeconds":4200},"clapping":{"activityDurationInSeconds":920,"activityTargetInSeconds":300},"brushingTeeth":{"activityDurationInSeconds":140,"activityTargetInSeconds":None},"brushingHair":{"activityDurationInSeconds":220,"activityTargetInSeconds":None},"cleaningHands":{"activityDurationInSeconds":220,"activityTargetInSeconds":None},"randomMotion":{"activityDurationInSeconds":2500,"activityTargetInSeconds":None}},{"date":"2023-09-24","motion":{"activityDurationInSeconds":4000,"activityTargetInSeconds":4200},"clapping":{"activityDurationInSeconds":940,"activityTargetInSeconds":300},"brushingTeeth":{"activityDurationInSeconds":140,"activityTargetInSeconds":None},"brushingHair":{"activityDurationInSeconds":220,"activityTargetInSeconds":None},"cleaningHands":{"activityDurationInSeconds":240,"activityTargetInSeconds":None},"randomMotion":{"activityDurationInSeconds":2460,"activityTargetInSeconds":None}},{"date":"2023-09-25","motion":{"activityDurationInSeconds":5200,"activityTargetInSeconds":4200},"clapping":{"activityDurationInSeconds":820,"activityTargetInSeconds":300},"brushingTeeth":{"activityDurationInSeconds":240,"activityTargetInSeconds":None},"brushingHair":{"activityDurationInSeconds":160,"activityTargetInSeconds":None},"cleaningHands":{"activityDurationInSeconds":0,"activityTargetInSeconds":None},"randomMotion":{"activityDurationInSeconds":3980,"activityTargetInSeconds":None}},{"date":"2023-09-26","motion":{"activityDurationInSeconds":5600,"activityTargetInSeconds":4200},"clapping":{"activityDurationInSeconds":960,"activityTargetInSeconds":300},"brushingTeeth":{"activityDurationInSeconds":240,"activityTargetInSeconds":None},"brushingHair":{"activityDurationInSeconds":120,"activityTargetInSeconds":None},"cleaningHands":{"activityDurationInSeconds":80,"activityTargetInSeconds":None},"randomMotion":{"activityDurationInSeconds":4200,"activityTargetInSeconds":None}},{"date":"2023-09-27","motion":{"activityDurationInSeconds":5600,"activityTargetInSeconds":4200},"clapping":{"activityDurationInSeconds":960,"activityTargetInSeconds":300},"brushingTeeth":{"activityDurationInSeconds":240,"activityTargetInSeconds":None},"brushingHair":{"activityDurationInSeconds":120,"activityTargetInSeconds":None},"cleaningHands":{"activityDurationInSeconds":80,"activityTargetInSeconds":None},"randomMotion":{"activityDurationInSeconds":4200,"activityTargetInSeconds":None}},{"date":"2023-09-28","motion":{"activityDurationInSeconds":5600,"activityTargetInSeconds":4200},"clapping":{"activityDurationInSeconds":960,"activityTargetInSeconds":300},"brushingTeeth":{"activityDurationInSeconds":240,"activityTargetInSeconds":None},"brushingHair":{"activityDurationInSeconds":120,"activityTargetInSeconds":None},"cleaningHands":{"activityDurationInSeconds":80,"activityTargetInSeconds":None},"randomMotion":{"activityDurationInSeconds":4200,"activityTargetInSeconds":None}},{"date":"2023-09-29","motion":{"activityDurationInSeconds":5600,"activityTargetInSeconds":4200},"clapping":{"activityDurationInSeconds":960,"activityTargetInSeconds":300},"brushingTeeth":{"activityDurationInSeconds":240,"activityTargetInSeconds":None},"brushingHair":{"activityDurationInSeconds":120,"activityTargetInSeconds":None},"cleaningHands":{"activityDurationInSeconds":80,"activityTargetInSeconds":None},"randomMotion":{"activityDurationInSeconds":4200,"activityTargetInSeconds":None}},{"date":"2023-09-30","motion":{"activityDurationInSeconds":5600,"activityTargetInSeconds":4200},"clapping":{"activityDurationInSeconds":960,"activityTargetInSeconds":300},"brushingTeeth":{"activityDurationInSeconds":240,"activityTargetInSeconds":None},"brushingHair":{"activityDurationInSeconds":120,"activityTargetInSeconds":None},"cleaningHands":{"activityDurationInSeconds":80,"activityTargetInSeconds":None},"randomMotion":{"activityDurationInSeconds":4200,"activityTargetInSeconds":None}}],
@@ -322,6 +292,75 @@ def get_monthly_summaries(patient_id: int, activity_month: datetime, db: Session
 
     return monthly_summary
 
+# Distribution of daily seconds per activity across patients, optionally compared with one patient
+@app.get("/population-stats/", tags=["Analytics"], response_model=_schemas.PopulationStats)
+def get_population_stats(start_date: datetime, end_date: datetime, patient_ids: List[int] = Query([]), bins: int = Query(10, ge=1, le=100), compare_patient_id: Optional[int] = None, db: Session = Depends(_services.get_read_db)):
+    if end_date < start_date:
+        raise HTTPException(
+            status_code=400, detail="end_date is before start_date"
+        )
+    return _analytics.compute_population_stats(db=db, start_date=start_date, end_date=end_date, patient_ids=patient_ids, bins=bins, compare_patient_id=compare_patient_id)
+
+# 7- and 28-day rolling averages and target adherence per activity, with the last `days` days as a series
+@app.get("/trend/{patient_id}", tags=["Analytics"], response_model=_schemas.Trend)
+def get_trend(patient_id: int, days: int = Query(28, ge=0, le=_analytics.TREND_HISTORY_DAYS), db: Session = Depends(_services.get_read_db)):
+    return _analytics.get_trend(db=db, patient_id=patient_id, days=days)
+
+# Endpoints for archiving closed months of activity frames
+@app.post("/archive/activityframes/", tags=["Maintenance"], response_model=List[_schemas.ArchivedMonth])
+def archive_closed_months(keep_months: int = Query(1, ge=1), export: bool = True, db: Session = Depends(_services.get_db)):
+    return _services.archive_closed_months(db=db, keep_months=keep_months, export=export)
+
+@app.post("/archive/activityframes/{activity_month}", tags=["Maintenance"], response_model=_schemas.ArchivedMonth)
+def archive_activityframes_month(activity_month: datetime, export: bool = True, db: Session = Depends(_services.get_db)):
+    if activity_month.strftime("%Y-%m") >= datetime.utcnow().strftime("%Y-%m"):
+        raise HTTPException(
+            status_code=400, detail="Only closed months can be archived"
+        )
+    return _services.archive_activityframes_month(db=db, activity_month=activity_month, export=export)
+
+# Endpoints for the summary precomputation
+def _precompute_status():
+    scheduler = _scheduler.scheduler
+    return _schemas.PrecomputeStatus(
+        enabled=_scheduler.PRECOMPUTE_ENABLED,
+        running=scheduler.running,
+        scheduledAt=_scheduler.PRECOMPUTE_AT,
+        workers=_scheduler.PRECOMPUTE_WORKERS,
+        nextRun=scheduler.next_run,
+        lastStarted=scheduler.last_started,
+        lastFinished=scheduler.last_finished,
+        lastPatientCount=scheduler.last_patient_count,
+        lastFailedCount=scheduler.last_failed_count,
+        storedSummaries=len(_summaries.precomputed),
+    )
+
+@app.get("/precompute/status", tags=["Maintenance"], response_model=_schemas.PrecomputeStatus)
+def read_precompute_status():
+    return _precompute_status()
+
+@app.post("/precompute/run", tags=["Maintenance"], response_model=_schemas.PrecomputeStatus)
+async def run_precompute():
+    # Returns right away; poll /precompute/status for the outcome
+    _scheduler.scheduler.start_run()
+    return _precompute_status()
+
+@app.get("/metrics/", tags=["Maintenance"], response_model=_schemas.Metrics)
+def read_metrics():
+    return _schemas.Metrics(
+        summaryCoalescing=_schemas.CoalescingStats(**_summaries.coalescer.stats()),
+        ingestAdmission=_schemas.AdmissionStats(**_admission.ingest.stats()),
+    )
+
+# Batch endpoints accept at most this many items or ids per request
+MAX_BATCH_SIZE = 1000
+
+def _check_batch_size(items):
+    if len(items) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=400, detail=f"Batch is limited to {MAX_BATCH_SIZE} items"
+        )
+
 # Endpoints for MedicalPersonel
 @app.post("/medicalpersonel/", tags=["Medical Personel"], response_model=_schemas.MedicalPersonel)
 def create_medicalpersonel(
@@ -335,12 +374,12 @@ def create_medicalpersonel(
     return _services.create_medicalpersonel(db=db, medicalpersonel=medicalpersonel)
 
 @app.get("/medicalpersonel/", tags=["Medical Personel"], response_model=List[_schemas.MedicalPersonel])
-def read_medicalpersonels(skip: int = 0, limit: int = 10, db: Session = Depends(_services.get_db)):
+def read_medicalpersonels(skip: int = 0, limit: int = 10, db: Session = Depends(_services.get_read_db)):
     medicalpersonels = _services.get_medicalpersonels(db=db, skip=skip, limit=limit)
     return medicalpersonels
 
 @app.get("/medicalpersonel/{medicalpersonel_id}", tags=["Medical Personel"], response_model=_schemas.MedicalPersonel)
-def read_medicalpersonel(medicalpersonel_id: int, db: Session = Depends(_services.get_db)):
+def read_medicalpersonel(medicalpersonel_id: int, db: Session = Depends(_services.get_read_db)):
     db_medicalpersonel = _services.get_medicalpersonel(db=db, medicalpersonel_id=medicalpersonel_id)
     if db_medicalpersonel is None:
         raise HTTPException(
@@ -382,12 +421,12 @@ def create_patient(
     return _services.create_patient(db=db, patient=patient)
 
 @app.get("/patients/", tags=["Patient"], response_model=List[_schemas.Patient])
-def read_patients(skip: int = 0, limit: int = 10, db: Session = Depends(_services.get_db)):
+def read_patients(skip: int = 0, limit: int = 10, db: Session = Depends(_services.get_read_db)):
     patients = _services.get_patients(db=db, skip=skip, limit=limit)
     return patients
 
 @app.get("/patients/{patient_id}", tags=["Patient"], response_model=_schemas.Patient)
-def read_patient(patient_id: int, db: Session = Depends(_services.get_db)):
+def read_patient(patient_id: int, db: Session = Depends(_services.get_read_db)):
     db_patient = _services.get_patient(db=db, patient_id=patient_id)
     if db_patient is None:
         raise HTTPException(
@@ -395,25 +434,50 @@ def read_patient(patient_id: int, db: Session = Depends(_services.get_db)):
         )
     return db_patient
 
+@app.post("/patients/batch/", tags=["Patient"], response_model=_schemas.PatientBatch)
+def create_patients_batch(patients: List[_schemas.PatientCreate], db: Session = Depends(_services.get_db)):
+    _check_batch_size(patients)
+    items, errors = _services.create_patients(db=db, patients=patients)
+    return {"items": items, "errors": errors}
+
+@app.get("/patients/batch/", tags=["Patient"], response_model=_schemas.PatientBatch)
+def read_patients_batch(ids: List[int] = Query([]), db: Session = Depends(_services.get_read_db)):
+    _check_batch_size(ids)
+    items = _services.get_patients_by_ids(db=db, patient_ids=ids)
+    return {"items": items, "errors": _services.get_missing_id_errors(items, ids, "Patient not found")}
+
+@app.delete("/patients/batch/", tags=["Patient"], response_model=_schemas.PatientBatch)
+def delete_patients_batch(ids: List[int] = Query([]), db: Session = Depends(_services.get_db)):
+    _check_batch_size(ids)
+    items, errors = _services.delete_patients(db=db, patient_ids=ids)
+    # Patient ids can be reused, so a deleted patient's trend must not outlive it
+    for item in items:
+        _analytics.trends.invalidate(item.id)
+    return {"items": items, "errors": errors}
+
 # Endpoints for Device
 @app.post("/devices/", tags=["Device"], response_model=_schemas.Device)
 def create_device(
     device: _schemas.DeviceCreate, db: Session = Depends(_services.get_db)
 ):
-    db_device = _services.get_device(db=db, device_id=device.id)
+    db_device = _services.get_device_by_mac_address(db=db, mac_address=device.mac_address)
     if db_device:
         raise HTTPException(
-            status_code=400, detail="Device with this ID already exists"
+            status_code=400, detail="Device with this MAC address already exists"
+        )
+    if device.patient_id is not None and _services.get_patient(db=db, patient_id=device.patient_id) is None:
+        raise HTTPException(
+            status_code=404, detail="Patient not found"
         )
     return _services.create_device(db=db, device=device)
 
 @app.get("/devices/", tags=["Device"], response_model=List[_schemas.Device])
-def read_devices(skip: int = 0, limit: int = 10, db: Session = Depends(_services.get_db)):
+def read_devices(skip: int = 0, limit: int = 10, db: Session = Depends(_services.get_read_db)):
     devices = _services.get_devices(db=db, skip=skip, limit=limit)
     return devices
 
 @app.get("/devices/{device_id}", tags=["Device"], response_model=_schemas.Device)
-def read_device(device_id: int, db: Session = Depends(_services.get_db)):
+def read_device(device_id: int, db: Session = Depends(_services.get_read_db)):
     db_device = _services.get_device(db=db, device_id=device_id)
     if db_device is None:
         raise HTTPException(
@@ -421,21 +485,72 @@ def read_device(device_id: int, db: Session = Depends(_services.get_db)):
         )
     return db_device
 
+@app.put("/devices/{device_id}", tags=["Device"], response_model=_schemas.Device)
+def update_device(device_id: int, device: _schemas.DeviceCreate, db: Session = Depends(_services.get_db)):
+    db_device = _services.get_device(db=db, device_id=device_id)
+    if db_device is None:
+        raise HTTPException(
+            status_code=404, detail="Device not found"
+        )
+    other_device = _services.get_device_by_mac_address(db=db, mac_address=device.mac_address)
+    if other_device is not None and other_device.id != device_id:
+        raise HTTPException(
+            status_code=400, detail="Device with this MAC address already exists"
+        )
+    if device.patient_id is not None and _services.get_patient(db=db, patient_id=device.patient_id) is None:
+        raise HTTPException(
+            status_code=404, detail="Patient not found"
+        )
+    return _services.update_device(db=db, device_id=device_id, device=device)
+
+@app.put("/devices/{device_id}/patient/{patient_id}", tags=["Device"], response_model=_schemas.Device)
+def assign_device(device_id: int, patient_id: int, db: Session = Depends(_services.get_db)):
+    db_device = _services.get_device(db=db, device_id=device_id)
+    if db_device is None:
+        raise HTTPException(
+            status_code=404, detail="Device not found"
+        )
+    if _services.get_patient(db=db, patient_id=patient_id) is None:
+        raise HTTPException(
+            status_code=404, detail="Patient not found"
+        )
+    return _services.assign_device(db=db, device_id=device_id, patient_id=patient_id)
+
+@app.post("/devices/batch/", tags=["Device"], response_model=_schemas.DeviceBatch)
+def create_devices_batch(devices: List[_schemas.DeviceCreate], db: Session = Depends(_services.get_db)):
+    _check_batch_size(devices)
+    items, errors = _services.create_devices(db=db, devices=devices)
+    return {"items": items, "errors": errors}
+
+@app.get("/devices/batch/", tags=["Device"], response_model=_schemas.DeviceBatch)
+def read_devices_batch(ids: List[int] = Query([]), db: Session = Depends(_services.get_read_db)):
+    _check_batch_size(ids)
+    items = _services.get_devices_by_ids(db=db, device_ids=ids)
+    return {"items": items, "errors": _services.get_missing_id_errors(items, ids, "Device not found")}
+
+@app.delete("/devices/batch/", tags=["Device"], response_model=_schemas.DeviceBatch)
+def delete_devices_batch(ids: List[int] = Query([]), db: Session = Depends(_services.get_db)):
+    _check_batch_size(ids)
+    items, errors = _services.delete_devices(db=db, device_ids=ids)
+    return {"items": items, "errors": errors}
+
 # Endpoints for ActivityFrame
-@app.post("/activityframes/", tags=["Activity Frame"], response_model=_schemas.ActivityFrame)
+@app.post("/activityframes/", tags=["Activity Frame"], response_model=_schemas.ActivityFrame, dependencies=[Depends(_admission.ingest.rate_limit("patient", "patient_id")), Depends(_admission.ingest.admit)])
 def create_activityframe(
     activityframe: _schemas.ActivityFrameCreate, db: Session = Depends(_services.get_db)
 ):
     # Create activity frame based on the provided data
-    return _services.create_activityframe(db=db, activityframe=activityframe)
+    db_activityframe = _services.create_activityframe(db=db, activityframe=activityframe)
+    _live.hub.publish(db, db_activityframe.patient_id, [db_activityframe])
+    return db_activityframe
 
 @app.get("/activityframes/", tags=["Activity Frame"], response_model=List[_schemas.ActivityFrame])
-def read_activityframes(skip: int = 0, limit: int = 10, db: Session = Depends(_services.get_db)):
+def read_activityframes(skip: int = 0, limit: int = 10, db: Session = Depends(_services.get_read_db)):
     activityframes = _services.get_activityframes(db=db, skip=skip, limit=limit)
     return activityframes
 
 @app.get("/activityframes/{activityframe_id}", tags=["Activity Frame"], response_model=_schemas.ActivityFrame)
-def read_activityframe(activityframe_id: int, db: Session = Depends(_services.get_db)):
+def read_activityframe(activityframe_id: int, db: Session = Depends(_services.get_read_db)):
     db_activityframe = _services.get_activityframe(db=db, activityframe_id=activityframe_id)
     if db_activityframe is None:
         raise HTTPException(
@@ -452,12 +567,12 @@ def create_activitytarget(
     return _services.create_activitytarget(db=db, activitytarget=activitytarget)
 
 @app.get("/activitytargets/", tags=["Activity Target"], response_model=List[_schemas.ActivityTarget])
-def read_activitytargets(skip: int = 0, limit: int = 10, db: Session = Depends(_services.get_db)):
+def read_activitytargets(skip: int = 0, limit: int = 10, db: Session = Depends(_services.get_read_db)):
     activitytargets = _services.get_activitytargets(db=db, skip=skip, limit=limit)
     return activitytargets
 
 @app.get("/activitytargets/{activitytarget_id}", tags=["Activity Target"], response_model=_schemas.ActivityTarget)
-def read_activitytarget(activitytarget_id: int, db: Session = Depends(_services.get_db)):
+def read_activitytarget(activitytarget_id: int, db: Session = Depends(_services.get_read_db)):
     db_activitytarget = _services.get_activitytarget(db=db, activitytarget_id=activitytarget_id)
     if db_activitytarget is None:
         raise HTTPException(
@@ -465,6 +580,24 @@ def read_activitytarget(activitytarget_id: int, db: Session = Depends(_services.
         )
     return db_activitytarget
 
+@app.post("/activitytargets/batch/", tags=["Activity Target"], response_model=_schemas.ActivityTargetBatch)
+def create_activitytargets_batch(activitytargets: List[_schemas.ActivityTargetCreate], db: Session = Depends(_services.get_db)):
+    _check_batch_size(activitytargets)
+    items, errors = _services.create_activitytargets(db=db, activitytargets=activitytargets)
+    return {"items": items, "errors": errors}
+
+@app.get("/activitytargets/batch/", tags=["Activity Target"], response_model=_schemas.ActivityTargetBatch)
+def read_activitytargets_batch(ids: List[int] = Query([]), db: Session = Depends(_services.get_read_db)):
+    _check_batch_size(ids)
+    items = _services.get_activitytargets_by_ids(db=db, activitytarget_ids=ids)
+    return {"items": items, "errors": _services.get_missing_id_errors(items, ids, "ActivityTarget not found")}
+
+@app.delete("/activitytargets/batch/", tags=["Activity Target"], response_model=_schemas.ActivityTargetBatch)
+def delete_activitytargets_batch(ids: List[int] = Query([]), db: Session = Depends(_services.get_db)):
+    _check_batch_size(ids)
+    items, errors = _services.delete_activitytargets(db=db, activitytarget_ids=ids)
+    return {"items": items, "errors": errors}
+
 # Endpoints for ActivityType
 @app.post("/activitytypes/", tags=["Activity Type"], response_model=_schemas.ActivityType)
 def create_activitytype(
@@ -474,12 +607,12 @@ def create_activitytype(
     return _services.create_activitytype(db=db, activitytype=activitytype)
 
 @app.get("/activitytypes/", tags=["Activity Type"], response_model=List[_schemas.ActivityType])
-def read_activitytypes(skip: int = 0, limit: int = 10, db: Session = Depends(_services.get_db)):
+def read_activitytypes(skip: int = 0, limit: int = 10, db: Session = Depends(_services.get_read_db)):
     activitytypes = _services.get_activitytypes(db=db, skip=skip, limit=limit)
     return activitytypes
 
 @app.get("/activitytypes/{activitytype_id}", tags=["Activity Type"], response_model=_schemas.ActivityType)
-def read_activitytype(activitytype_id: int, db: Session = Depends(_services.get_db)):
+def read_activitytype(activitytype_id: int, db: Session = Depends(_services.get_read_db)):
     db_activitytype = _services.get_activitytype(db=db, activitytype_id=activitytype_id)
     if db_activitytype is None:
         raise HTTPException(
@@ -487,5 +620,23 @@ def read_activitytype(activitytype_id: int, db: Session = Depends(_services.get_
         )
     return db_activitytype
 
+@app.post("/activitytypes/batch/", tags=["Activity Type"], response_model=_schemas.ActivityTypeBatch)
+def create_activitytypes_batch(activitytypes: List[_schemas.ActivityTypeCreate], db: Session = Depends(_services.get_db)):
+    _check_batch_size(activitytypes)
+    items, errors = _services.create_activitytypes(db=db, activitytypes=activitytypes)
+    return {"items": items, "errors": errors}
+
+@app.get("/activitytypes/batch/", tags=["Activity Type"], response_model=_schemas.ActivityTypeBatch)
+def read_activitytypes_batch(ids: List[int] = Query([]), db: Session = Depends(_services.get_read_db)):
+    _check_batch_size(ids)
+    items = _services.get_activitytypes_by_ids(db=db, activitytype_ids=ids)
+    return {"items": items, "errors": _services.get_missing_id_errors(items, ids, "ActivityType not found")}
+
+@app.delete("/activitytypes/batch/", tags=["Activity Type"], response_model=_schemas.ActivityTypeBatch)
+def delete_activitytypes_batch(ids: List[int] = Query([]), db: Session = Depends(_services.get_db)):
+    _check_batch_size(ids)
+    items, errors = _services.delete_activitytypes(db=db, activitytype_ids=ids)
+    return {"items": items, "errors": errors}
+
 if __name__ == '__main__':
     uvicorn.run(app, host='0.0.0.0', port=8000)
\ No newline at end of file
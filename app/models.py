@@ -47,16 +47,59 @@ class Device(_database.Base):
 
 class ActivityFrame(_database.Base):
     __tablename__ = "activityFrames"
+    __table_args__ = (
+        _sql.Index("ix_activityFrames_patient_id_date_started", "patient_id", "date_started"),
+        # Frame ids are kept in the monthly archives, so they must never be reused
+        {"sqlite_autoincrement": True},
+    )
     id = _sql.Column(_sql.Integer, primary_key=True)
     patient_id = _sql.Column(_sql.Integer, _sql.ForeignKey("patients.id"))
     activity_id = _sql.Column(_sql.Integer, _sql.ForeignKey("activitytypes.id"))
-    date_started = _sql.Column(_sql.DateTime, default=_dt.datetime.utcnow)
+    date_started = _sql.Column(_sql.DateTime, default=_dt.datetime.utcnow, index=True)
     date_finished = _sql.Column(_sql.DateTime, default=_dt.datetime.utcnow)
 
     patient = _orm.relationship("Patient", back_populates="activityFrames")
     activity_type = _orm.relationship("ActivityType", back_populates="frame")
 
 
+# Daily totals of activity frames from archived months
+class ActivityFrameRollup(_database.Base):
+    __tablename__ = "activityFrameRollups"
+    __table_args__ = (
+        _sql.UniqueConstraint("patient_id", "date", "activity_id"),
+    )
+    id = _sql.Column(_sql.Integer, primary_key=True)
+    patient_id = _sql.Column(_sql.Integer, _sql.ForeignKey("patients.id"))
+    activity_id = _sql.Column(_sql.Integer, _sql.ForeignKey("activitytypes.id"))
+    date = _sql.Column(_sql.Date)
+    duration_in_seconds = _sql.Column(_sql.Float, default=0)
+    frame_count = _sql.Column(_sql.Integer, default=0)
+
+
+# Totals of archived frames that ran past midnight, by the day they started and the day they finished.
+# Daily summaries leave these frames out; ranges that include the finishing day count them on the start day.
+class ActivityFrameOvernightRollup(_database.Base):
+    __tablename__ = "activityFrameOvernightRollups"
+    __table_args__ = (
+        _sql.UniqueConstraint("patient_id", "date", "date_finished", "activity_id"),
+    )
+    id = _sql.Column(_sql.Integer, primary_key=True)
+    patient_id = _sql.Column(_sql.Integer, _sql.ForeignKey("patients.id"))
+    activity_id = _sql.Column(_sql.Integer, _sql.ForeignKey("activitytypes.id"))
+    date = _sql.Column(_sql.Date)
+    date_finished = _sql.Column(_sql.Date)
+    duration_in_seconds = _sql.Column(_sql.Float, default=0)
+    frame_count = _sql.Column(_sql.Integer, default=0)
+
+
+class ArchivedMonth(_database.Base):
+    __tablename__ = "archivedMonths"
+    month = _sql.Column(_sql.String, primary_key=True)
+    frame_count = _sql.Column(_sql.Integer, default=0)
+    export_path = _sql.Column(_sql.String, nullable=True)
+    date_archived = _sql.Column(_sql.DateTime, default=_dt.datetime.utcnow)
+
+
 class ActivityTarget(_database.Base):
     __tablename__ = "activityTargets"
     id = _sql.Column(_sql.Integer, primary_key=True)
@@ -70,6 +113,13 @@ class ActivityTarget(_database.Base):
     patient = _orm.relationship("Patient", back_populates="activityTargets")
 
 
+# Bumped on every write that changes a patient's frames or targets; used for ETags
+class PatientDataVersion(_database.Base):
+    __tablename__ = "patientDataVersions"
+    patient_id = _sql.Column(_sql.Integer, _sql.ForeignKey("patients.id"), primary_key=True)
+    version = _sql.Column(_sql.Integer, default=0)
+
+
 class ActivityType(_database.Base):
     __tablename__ = "activitytypes"
     id = _sql.Column(_sql.Integer, primary_key=True)
@@ -0,0 +1,43 @@
+import threading
+
+from sqlalchemy.orm import Session
+
+import app.models as _models
+
+
+# In-memory map of MAC address to (device_id, patient_id), so device-keyed ingest needs no lookup query.
+# The device services keep it current on create, update, reassign and delete; only they overwrite entries.
+class DeviceRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._devices = {}
+
+    def warm(self, db: Session):
+        devices = db.query(_models.Device.mac_address, _models.Device.id, _models.Device.patient_id).all()
+        with self._lock:
+            self._devices = {mac_address: (device_id, patient_id) for mac_address, device_id, patient_id in devices}
+
+    def resolve(self, db: Session, mac_address: str):
+        with self._lock:
+            entry = self._devices.get(mac_address)
+        if entry is not None:
+            return entry
+
+        # Fall back to the database for devices registered since the registry was warmed
+        db_device = db.query(_models.Device).filter(_models.Device.mac_address == mac_address).first()
+        if db_device is None:
+            return None
+        # Only insert if still absent: a device write that committed after the read above has already put the newer entry
+        with self._lock:
+            return self._devices.setdefault(mac_address, (db_device.id, db_device.patient_id))
+
+    def put(self, db_device: _models.Device):
+        with self._lock:
+            self._devices[db_device.mac_address] = (db_device.id, db_device.patient_id)
+
+    def invalidate(self, mac_address: str):
+        with self._lock:
+            self._devices.pop(mac_address, None)
+
+
+devices = DeviceRegistry()
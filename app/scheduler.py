@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time, timedelta
+
+import app.database as _database
+import app.services as _services
+import app.summaries as _summaries
+
+# UTC time of day ("HH:MM") at which yesterday's and the current month's summaries are precomputed,
+# chosen to fall after the nightly device sync
+PRECOMPUTE_AT = os.environ.get("SUMMARY_PRECOMPUTE_AT", "04:00")
+PRECOMPUTE_WORKERS = int(os.environ.get("SUMMARY_PRECOMPUTE_WORKERS", "4"))
+PRECOMPUTE_ENABLED = os.environ.get("SUMMARY_PRECOMPUTE_ENABLED", "true").lower() in ("1", "true", "yes")
+# Patients with frames in this many days are precomputed
+ACTIVE_PATIENT_DAYS = int(os.environ.get("SUMMARY_ACTIVE_PATIENT_DAYS", "30"))
+
+logger = logging.getLogger(__name__)
+
+
+class SummaryScheduler:
+    def __init__(self):
+        self._task = None
+        self._run = None
+        self.next_run = None
+        self.last_started = None
+        self.last_finished = None
+        self.last_patient_count = 0
+        self.last_failed_count = 0
+
+    @property
+    def running(self):
+        return self._run is not None and not self._run.done()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run_forever())
+
+    async def stop(self):
+        for task in (self._task, self._run):
+            if task is not None:
+                task.cancel()
+
+    def _next_run_after(self, now: datetime):
+        run_at = datetime.combine(now.date(), time.fromisoformat(PRECOMPUTE_AT))
+        if run_at <= now:
+            run_at += timedelta(days=1)
+        return run_at
+
+    async def _run_forever(self):
+        while True:
+            self.next_run = self._next_run_after(datetime.utcnow())
+            await asyncio.sleep((self.next_run - datetime.utcnow()).total_seconds())
+            try:
+                await self.trigger()
+            except Exception:
+                # Already logged by the run's done callback
+                pass
+
+    def start_run(self):
+        # Starts a run unless one is in progress, without waiting for it
+        if not self.running:
+            self._run = asyncio.create_task(self._run_once())
+            self._run.add_done_callback(self._log_failed_run)
+        return self._run
+
+    async def trigger(self):
+        # Starts a run unless one is in progress, and waits for it
+        await asyncio.shield(self.start_run())
+
+    def _log_failed_run(self, run: asyncio.Task):
+        if not run.cancelled() and run.exception() is not None:
+            logger.error("Precomputing summaries failed", exc_info=run.exception())
+
+    async def _run_once(self):
+        loop = asyncio.get_running_loop()
+        self.last_started = datetime.utcnow()
+        today = self.last_started.date()
+        activity_date = datetime.combine(today - timedelta(days=1), time.min)
+        activity_month = datetime.combine(today.replace(day=1), time.min)
+
+        patient_ids = await loop.run_in_executor(None, self._get_active_patient_ids, datetime.combine(today, time.min) - timedelta(days=ACTIVE_PATIENT_DAYS))
+
+        executor = ThreadPoolExecutor(max_workers=PRECOMPUTE_WORKERS, thread_name_prefix="summary-precompute")
+        try:
+            results = await asyncio.gather(*[
+                loop.run_in_executor(executor, self._precompute_patient, patient_id, activity_date, activity_month)
+                for patient_id in patient_ids
+            ], return_exceptions=True)
+        except asyncio.CancelledError:
+            # Cancelled on shutdown; drop the queued patients instead of blocking the event loop on them
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        executor.shutdown()
+
+        entries = {}
+        failed_count = 0
+        for patient_id, result in zip(patient_ids, results):
+            if isinstance(result, Exception):
+                logger.warning("Precomputing summaries for patient %s failed: %r", patient_id, result)
+                failed_count += 1
+                continue
+            entries.update(result)
+
+        _summaries.precomputed.replace(entries)
+        self.last_patient_count = len(patient_ids)
+        self.last_failed_count = failed_count
+        self.last_finished = datetime.utcnow()
+
+    def _get_active_patient_ids(self, since: datetime):
+        db = _database.ReadSessionLocal()
+        try:
+            return _services.get_active_patient_ids(db=db, since=since)
+        finally:
+            db.close()
+
+    def _precompute_patient(self, patient_id: int, activity_date: datetime, activity_month: datetime):
+        db = _database.ReadSessionLocal()
+        try:
+            # Read the version first, so a write during the computation makes the result stale rather than wrong
+            version = _services.get_patient_data_version(db=db, patient_id=patient_id)
+            daily_summary = _summaries.compute_daily_summary(db=db, patient_id=patient_id, activity_date=activity_date)
+            monthly_summary = _summaries.compute_monthly_summary(db=db, patient_id=patient_id, activity_month=activity_month)
+            return {
+                ("daily", patient_id, activity_date.strftime("%Y-%m-%d")): (version, daily_summary),
+                ("monthly", patient_id, activity_month.strftime("%Y-%m")): (version, monthly_summary),
+            }
+        finally:
+            db.close()
+
+
+scheduler = SummaryScheduler()
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Dict, List, Optional
 from datetime import datetime
 
 # Medical Personel
@@ -42,12 +42,12 @@ class _DeviceBase(BaseModel):
     mac_address: str
 
 class DeviceCreate(_DeviceBase):
-    pass
+    patient_id: Optional[int] = None
 
 class Device(_DeviceBase):
     id: int
     date_created: datetime
-    patient_id: int
+    patient_id: Optional[int]
 
     class Config:
         orm_mode = True
@@ -106,6 +106,12 @@ class ActivityFrameRequest(BaseModel):
     dataFromDevice: str
     patientId: int
 
+class DeviceActivityFrameRequest(BaseModel):
+    currentTime: datetime
+    deviceTime: int
+    dataFromDevice: str
+    macAddress: str
+
 class ActivityDuration(BaseModel):
     activityDurationInSeconds: int
     activityTargetInSeconds: Optional[int]
@@ -120,4 +126,121 @@ class DailySummary(BaseModel):
     randomMotion: ActivityDuration
 
 class MonthlySummary(BaseModel):
-    monthlySummaries: List[DailySummary]
\ No newline at end of file
+    monthlySummaries: List[DailySummary]
+
+# Batch operations
+class BatchItemError(BaseModel):
+    # `index` points into the request body for creates, `id` is the requested id for gets and deletes
+    index: Optional[int] = None
+    id: Optional[int] = None
+    detail: str
+
+class PatientBatch(BaseModel):
+    items: List[Patient]
+    errors: List[BatchItemError]
+
+class DeviceBatch(BaseModel):
+    items: List[Device]
+    errors: List[BatchItemError]
+
+class ActivityTargetBatch(BaseModel):
+    items: List[ActivityTarget]
+    errors: List[BatchItemError]
+
+class ActivityTypeBatch(BaseModel):
+    items: List[ActivityType]
+    errors: List[BatchItemError]
+
+# Population statistics
+class ActivityDistribution(BaseModel):
+    # Distribution of seconds per patient-day over all patient-days with recorded activity
+    count: int
+    meanInSeconds: float
+    percentilesInSeconds: Dict[str, float]
+    histogramEdgesInSeconds: List[float]
+    histogramCounts: List[int]
+    patientMeanInSeconds: Optional[float]
+    patientPercentile: Optional[float]
+
+class PopulationStats(BaseModel):
+    startDate: str
+    endDate: str
+    patientCount: int
+    patientDays: int
+    motion: ActivityDistribution
+    clapping: ActivityDistribution
+    brushingTeeth: ActivityDistribution
+    brushingHair: ActivityDistribution
+    cleaningHands: ActivityDistribution
+    randomMotion: ActivityDistribution
+
+# Rolling trends
+class ActivityTrend(BaseModel):
+    rollingAverage7InSeconds: float = 0.0
+    rollingAverage28InSeconds: float = 0.0
+    targetInSeconds: Optional[int] = None
+    # Share of days meeting the target, only for activities with a target
+    adherence7: Optional[float] = None
+    adherence28: Optional[float] = None
+    adherenceAllTime: Optional[float] = None
+
+class TrendDay(BaseModel):
+    date: str
+    rollingAverage7InSeconds: Dict[str, float]
+    rollingAverage28InSeconds: Dict[str, float]
+
+class Trend(BaseModel):
+    patientId: int
+    firstDate: Optional[str]
+    lastCompleteDate: Optional[str]
+    motion: ActivityTrend
+    clapping: ActivityTrend
+    brushingTeeth: ActivityTrend
+    brushingHair: ActivityTrend
+    cleaningHands: ActivityTrend
+    randomMotion: ActivityTrend
+    days: List[TrendDay]
+
+# Archival
+class ArchivedMonth(BaseModel):
+    month: str
+    frame_count: int
+    export_path: Optional[str]
+    date_archived: datetime
+
+    class Config:
+        orm_mode = True
+
+
+# Summary precomputation
+class PrecomputeStatus(BaseModel):
+    enabled: bool
+    running: bool
+    scheduledAt: str
+    workers: int
+    nextRun: Optional[datetime]
+    lastStarted: Optional[datetime]
+    lastFinished: Optional[datetime]
+    lastPatientCount: int
+    lastFailedCount: int
+    storedSummaries: int
+
+
+# Metrics
+class CoalescingStats(BaseModel):
+    # Computations run, and requests that got the result of another request's computation
+    executions: int
+    shared: int
+    inFlight: int
+
+class AdmissionStats(BaseModel):
+    active: int
+    waiting: int
+    admitted: int
+    rejectedQueueFull: int
+    rejectedTimeout: int
+    rejectedRateLimited: int
+
+class Metrics(BaseModel):
+    summaryCoalescing: CoalescingStats
+    ingestAdmission: AdmissionStats
\ No newline at end of file
@@ -1,10 +1,24 @@
+import os
+
+import sqlalchemy as _sql
+from sqlalchemy.dialects.sqlite import insert as _sqlite_insert
 from sqlalchemy.orm import Session
-from . import models, database, schemas
-from datetime import datetime, timezone, time
+from . import models, database, registry, schemas
+from datetime import date, datetime, timezone, time, timedelta
 
 
 def create_database():
-    return database.Base.metadata.create_all(bind=database.engine)
+    database.Base.metadata.create_all(bind=database.engine)
+    # create_all skips indexes on tables that already exist
+    for index in models.ActivityFrame.__table__.indexes:
+        index.create(bind=database.engine, checkfirst=True)
+
+def warm_device_registry():
+    db = database.SessionLocal()
+    try:
+        registry.devices.warm(db)
+    finally:
+        db.close()
 
 def get_db():
     db = database.SessionLocal()
@@ -13,6 +27,14 @@ def get_db():
     finally:
         db.close()
 
+# Read-only session for GET endpoints, so reads never hold connections or locks that ingest needs
+def get_read_db():
+    db = database.ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
 # Medical Personel
 def get_medicalpersonel(db: Session, medicalpersonel_id: int):
     return db.query(models.MedicalPersonel).filter(models.MedicalPersonel.id == medicalpersonel_id).first()
@@ -96,26 +118,43 @@ def update_patient(db: Session, patient_id: int, patient: schemas.PatientCreate)
 def get_device(db: Session, device_id: int):
     return db.query(models.Device).filter(models.Device.id == device_id).first()
 
+def get_device_by_mac_address(db: Session, mac_address: str):
+    return db.query(models.Device).filter(models.Device.mac_address == mac_address).first()
+
 def get_devices(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.Device).offset(skip).limit(limit).all()
 
 def create_device(db: Session, device: schemas.DeviceCreate):
-    db_device = models.Device(mac_address=device.mac_address)
+    db_device = models.Device(mac_address=device.mac_address, patient_id=device.patient_id)
     db.add(db_device)
     db.commit()
     db.refresh(db_device)
+    registry.devices.put(db_device)
     return db_device
 
 def delete_device(db: Session, device_id: int):
     device = db.query(models.Device).filter(models.Device.id == device_id).first()
     db.delete(device)
     db.commit()
+    registry.devices.invalidate(device.mac_address)
 
 def update_device(db: Session, device_id: int, device: schemas.DeviceCreate):
     db_device = get_device(db=db, device_id=device_id)
+    previous_mac_address = db_device.mac_address
     db_device.mac_address = device.mac_address
+    db_device.patient_id = device.patient_id
+    db.commit()
+    db.refresh(db_device)
+    registry.devices.invalidate(previous_mac_address)
+    registry.devices.put(db_device)
+    return db_device
+
+def assign_device(db: Session, device_id: int, patient_id: int):
+    db_device = get_device(db=db, device_id=device_id)
+    db_device.patient_id = patient_id
     db.commit()
     db.refresh(db_device)
+    registry.devices.put(db_device)
     return db_device
 
 # ActivityFrame
@@ -133,13 +172,30 @@ def create_activityframe(db: Session, activityframe: schemas.ActivityFrameCreate
         patient_id = activityframe.patient_id
     )
     db.add(db_activityframe)
+    bump_patient_data_version(db=db, patient_id=activityframe.patient_id)
     db.commit()
     db.refresh(db_activityframe)
     return db_activityframe
 
+def create_activityframes(db: Session, activityframes):
+    # All frames of one upload in a single transaction
+    db_activityframes = [
+        models.ActivityFrame(
+            activity_id = activityframe.activity_id,
+            date_started = activityframe.date_started,
+            date_finished = activityframe.date_finished,
+            patient_id = activityframe.patient_id
+        )
+        for activityframe in activityframes
+    ]
+    for patient_id in {activityframe.patient_id for activityframe in activityframes}:
+        bump_patient_data_version(db=db, patient_id=patient_id)
+    return _create_all(db=db, model=models.ActivityFrame, db_rows=db_activityframes)
+
 def delete_activityframe(db: Session, activityframe_id: int):
     activityframe = db.query(models.ActivityFrame).filter(models.ActivityFrame.id == activityframe_id).first()
     db.delete(activityframe)
+    bump_patient_data_version(db=db, patient_id=activityframe.patient_id)
     db.commit()
 
 def update_activityframe(db: Session, activityframe_id: int, activityframe: schemas.ActivityFrameCreate):
@@ -159,11 +215,12 @@ def get_activitytargets(db: Session, skip: int = 0, limit: int = 100):
 
 def create_activitytarget(db: Session, activitytarget: schemas.ActivityTargetCreate):
     db_activitytarget = models.ActivityTarget(
+        patient_id = activitytarget.patient_id,
         medicalpersonel_id = activitytarget.medicalpersonel_id,
-        activity_id = activitytarget.activity_id,
-        date = activitytarget.date
+        activity_id = activitytarget.activity_id
     )
     db.add(db_activitytarget)
+    bump_patient_data_version(db=db, patient_id=activitytarget.patient_id)
     db.commit()
     db.refresh(db_activitytarget)
     return db_activitytarget
@@ -171,13 +228,16 @@ def create_activitytarget(db: Session, activitytarget: schemas.ActivityTargetCre
 def delete_activitytarget(db: Session, activitytarget_id: int):
     activitytarget = db.query(models.ActivityTarget).filter(models.ActivityTarget.id == activitytarget_id).first()
     db.delete(activitytarget)
+    bump_patient_data_version(db=db, patient_id=activitytarget.patient_id)
     db.commit()
 
 def update_activitytarget(db: Session, activitytarget_id: int, activitytarget: schemas.ActivityTargetCreate):
     db_activitytarget = get_activitytarget(db=db, activitytarget_id=activitytarget_id)
+    bump_patient_data_version(db=db, patient_id=db_activitytarget.patient_id)
+    db_activitytarget.patient_id = activitytarget.patient_id
     db_activitytarget.medicalpersonel_id = activitytarget.medicalpersonel_id
     db_activitytarget.activity_id = activitytarget.activity_id
-    db_activitytarget.date = activitytarget.date
+    bump_patient_data_version(db=db, patient_id=activitytarget.patient_id)
     db.commit()
     db.refresh(db_activitytarget)
     return db_activitytarget
@@ -208,10 +268,485 @@ def update_activitytype(db: Session, activitytype_id: int, activitytype: schemas
     db.refresh(db_activitytype)
     return db_activitytype
 
+# Batch operations
+# Each batch validates with set-based queries, writes in one transaction and reports errors per item
+def _get_by_ids(db: Session, model, ids):
+    # Returns the rows in the order of `ids`, without duplicates
+    ids = list(dict.fromkeys(ids))
+    rows = {row.id: row for row in db.query(model).filter(model.id.in_(ids)).all()} if ids else {}
+    return [rows[id] for id in ids if id in rows]
+
+def get_missing_id_errors(rows, ids, detail: str):
+    found_ids = {row.id for row in rows}
+    return [schemas.BatchItemError(id=id, detail=detail) for id in dict.fromkeys(ids) if id not in found_ids]
+
+def _create_all(db: Session, model, db_rows):
+    db.add_all(db_rows)
+    db.flush()
+    ids = [db_row.id for db_row in db_rows]
+    db.commit()
+    # Reload in one query instead of one refresh per row
+    return _get_by_ids(db=db, model=model, ids=ids)
+
+def _delete_all(db: Session, model, db_rows):
+    # One bulk DELETE; the rows are detached first so they can still be returned after the commit
+    ids = [db_row.id for db_row in db_rows]
+    for db_row in db_rows:
+        db.expunge(db_row)
+    if ids:
+        db.query(model).filter(model.id.in_(ids)).delete(synchronize_session=False)
+    db.commit()
+
+def get_patients_by_ids(db: Session, patient_ids):
+    return _get_by_ids(db=db, model=models.Patient, ids=patient_ids)
+
+def create_patients(db: Session, patients):
+    errors = []
+    emails = {patient.email for patient in patients}
+    taken_emails = {email for (email,) in db.query(models.Patient.email).filter(models.Patient.email.in_(emails))}
+
+    db_patients = []
+    for index, patient in enumerate(patients):
+        if patient.email in taken_emails:
+            errors.append(schemas.BatchItemError(index=index, detail="Email is already in use"))
+            continue
+        taken_emails.add(patient.email)
+        db_patients.append(models.Patient(
+            first_name = patient.first_name,
+            last_name = patient.last_name,
+            email = patient.email,
+            hashed_password=patient.password + "thisisnotsecure",
+            medicalpersonel_id=patient.medicalpersonel_id
+        ))
+
+    return _create_all(db=db, model=models.Patient, db_rows=db_patients), errors
+
+def delete_patients(db: Session, patient_ids):
+    db_patients = get_patients_by_ids(db=db, patient_ids=patient_ids)
+    found_ids = [db_patient.id for db_patient in db_patients]
+    mac_addresses = []
+    if found_ids:
+        mac_addresses = [
+            mac_address for (mac_address,) in db.query(models.Device.mac_address).filter(models.Device.patient_id.in_(found_ids))
+        ]
+        # A patient's frames, targets and rollups go with it; its devices are unassigned
+        for model in (models.ActivityFrame, models.ActivityTarget, models.ActivityFrameRollup, models.ActivityFrameOvernightRollup):
+            db.query(model).filter(model.patient_id.in_(found_ids)).delete(synchronize_session=False)
+        db.query(models.Device).filter(models.Device.patient_id.in_(found_ids)).update(
+            {models.Device.patient_id: None}, synchronize_session=False
+        )
+        for patient_id in found_ids:
+            bump_patient_data_version(db=db, patient_id=patient_id)
+    _delete_all(db=db, model=models.Patient, db_rows=db_patients)
+    for mac_address in mac_addresses:
+        registry.devices.invalidate(mac_address)
+    return db_patients, get_missing_id_errors(db_patients, patient_ids, "Patient not found")
+
+def get_devices_by_ids(db: Session, device_ids):
+    return _get_by_ids(db=db, model=models.Device, ids=device_ids)
+
+def create_devices(db: Session, devices):
+    errors = []
+    mac_addresses = {device.mac_address for device in devices}
+    taken_mac_addresses = {
+        mac_address for (mac_address,) in db.query(models.Device.mac_address).filter(models.Device.mac_address.in_(mac_addresses))
+    }
+    patient_ids = {device.patient_id for device in devices if device.patient_id is not None}
+    known_patient_ids = {id for (id,) in db.query(models.Patient.id).filter(models.Patient.id.in_(patient_ids))}
+
+    db_devices = []
+    for index, device in enumerate(devices):
+        if device.mac_address in taken_mac_addresses:
+            errors.append(schemas.BatchItemError(index=index, detail="Device with this MAC address already exists"))
+            continue
+        if device.patient_id is not None and device.patient_id not in known_patient_ids:
+            errors.append(schemas.BatchItemError(index=index, detail="Patient not found"))
+            continue
+        taken_mac_addresses.add(device.mac_address)
+        db_devices.append(models.Device(mac_address=device.mac_address, patient_id=device.patient_id))
+
+    db_devices = _create_all(db=db, model=models.Device, db_rows=db_devices)
+    for db_device in db_devices:
+        registry.devices.put(db_device)
+    return db_devices, errors
+
+def delete_devices(db: Session, device_ids):
+    db_devices = get_devices_by_ids(db=db, device_ids=device_ids)
+    mac_addresses = [db_device.mac_address for db_device in db_devices]
+    _delete_all(db=db, model=models.Device, db_rows=db_devices)
+    for mac_address in mac_addresses:
+        registry.devices.invalidate(mac_address)
+    return db_devices, get_missing_id_errors(db_devices, device_ids, "Device not found")
+
+def get_activitytargets_by_ids(db: Session, activitytarget_ids):
+    return _get_by_ids(db=db, model=models.ActivityTarget, ids=activitytarget_ids)
+
+def create_activitytargets(db: Session, activitytargets):
+    errors = []
+    patient_ids = {activitytarget.patient_id for activitytarget in activitytargets}
+    known_patient_ids = {id for (id,) in db.query(models.Patient.id).filter(models.Patient.id.in_(patient_ids))}
+    activity_ids = {activitytarget.activity_id for activitytarget in activitytargets}
+    known_activity_ids = {id for (id,) in db.query(models.ActivityType.id).filter(models.ActivityType.id.in_(activity_ids))}
+
+    db_activitytargets = []
+    for index, activitytarget in enumerate(activitytargets):
+        if activitytarget.patient_id not in known_patient_ids:
+            errors.append(schemas.BatchItemError(index=index, detail="Patient not found"))
+            continue
+        if activitytarget.activity_id not in known_activity_ids:
+            errors.append(schemas.BatchItemError(index=index, detail="ActivityType not found"))
+            continue
+        db_activitytargets.append(models.ActivityTarget(
+            patient_id = activitytarget.patient_id,
+            medicalpersonel_id = activitytarget.medicalpersonel_id,
+            activity_id = activitytarget.activity_id
+        ))
+
+    for patient_id in {db_activitytarget.patient_id for db_activitytarget in db_activitytargets}:
+        bump_patient_data_version(db=db, patient_id=patient_id)
+
+    return _create_all(db=db, model=models.ActivityTarget, db_rows=db_activitytargets), errors
+
+def delete_activitytargets(db: Session, activitytarget_ids):
+    db_activitytargets = get_activitytargets_by_ids(db=db, activitytarget_ids=activitytarget_ids)
+    for patient_id in {db_activitytarget.patient_id for db_activitytarget in db_activitytargets}:
+        bump_patient_data_version(db=db, patient_id=patient_id)
+    _delete_all(db=db, model=models.ActivityTarget, db_rows=db_activitytargets)
+    return db_activitytargets, get_missing_id_errors(db_activitytargets, activitytarget_ids, "ActivityTarget not found")
+
+def get_activitytypes_by_ids(db: Session, activitytype_ids):
+    return _get_by_ids(db=db, model=models.ActivityType, ids=activitytype_ids)
+
+def create_activitytypes(db: Session, activitytypes):
+    errors = []
+    types = {activitytype.type for activitytype in activitytypes}
+    taken_types = {type for (type,) in db.query(models.ActivityType.type).filter(models.ActivityType.type.in_(types))}
+
+    db_activitytypes = []
+    for index, activitytype in enumerate(activitytypes):
+        if activitytype.type in taken_types:
+            errors.append(schemas.BatchItemError(index=index, detail="ActivityType already exists"))
+            continue
+        taken_types.add(activitytype.type)
+        db_activitytypes.append(models.ActivityType(type = activitytype.type))
+
+    return _create_all(db=db, model=models.ActivityType, db_rows=db_activitytypes), errors
+
+def delete_activitytypes(db: Session, activitytype_ids):
+    db_activitytypes = get_activitytypes_by_ids(db=db, activitytype_ids=activitytype_ids)
+    errors = get_missing_id_errors(db_activitytypes, activitytype_ids, "ActivityType not found")
+
+    # Types still referenced by frames, targets or rollups are kept, since their rows cannot lose the type
+    found_ids = [db_activitytype.id for db_activitytype in db_activitytypes]
+    used_ids = set()
+    if found_ids:
+        used_ids = {id for (id,) in db.execute(_sql.union(*(
+            _sql.select(model.activity_id).where(model.activity_id.in_(found_ids))
+            for model in (models.ActivityFrame, models.ActivityTarget, models.ActivityFrameRollup, models.ActivityFrameOvernightRollup)
+        )))}
+    errors += [schemas.BatchItemError(id=id, detail="ActivityType is in use") for id in found_ids if id in used_ids]
+    db_activitytypes = [db_activitytype for db_activitytype in db_activitytypes if db_activitytype.id not in used_ids]
+
+    _delete_all(db=db, model=models.ActivityType, db_rows=db_activitytypes)
+    return db_activitytypes, errors
+
+# PatientDataVersion
+def get_patient_data_version(db: Session, patient_id: int):
+    return db.query(models.PatientDataVersion.version).filter(models.PatientDataVersion.patient_id == patient_id).scalar() or 0
+
+def bump_patient_data_version(db: Session, patient_id: int):
+    # Does not commit, so the bump lands in the same transaction as the write that caused it
+    if patient_id is None:
+        return
+    statement = _sqlite_insert(models.PatientDataVersion).values(patient_id=patient_id, version=1)
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[models.PatientDataVersion.patient_id],
+        set_={"version": models.PatientDataVersion.version + 1}
+    ))
+
 # Custom services for endpoints
 def get_activityframes_for_patient_and_date(db: Session, patient_id: int, start_datetime: datetime, end_datetime: datetime):
     return db.query(models.ActivityFrame).filter(
         models.ActivityFrame.patient_id == patient_id,
         models.ActivityFrame.date_started >= start_datetime,
         models.ActivityFrame.date_finished <= end_datetime
-    ).all()
\ No newline at end of file
+    ).all()
+
+def get_active_patient_ids(db: Session, since: datetime):
+    return [patient_id for (patient_id,) in db.query(models.ActivityFrame.patient_id).filter(
+        models.ActivityFrame.date_started >= since
+    ).distinct()]
+
+# Duration of a frame in seconds, computed by SQLite and rounded to the millisecond resolution of the device
+_frame_duration_in_seconds = _sql.func.round(
+    (_sql.func.julianday(models.ActivityFrame.date_finished) - _sql.func.julianday(models.ActivityFrame.date_started)) * 86400000.0
+) / 1000.0
+
+# Frames count toward the day they started on. Per-day totals (daily summaries, trends, population
+# statistics, live deltas) only count frames that also finished that day; the monthly summary counts a
+# frame that runs past midnight as long as it finishes within the month.
+_frame_day = _sql.func.date(models.ActivityFrame.date_started)
+_frame_within_day = _sql.func.date(models.ActivityFrame.date_finished) == _frame_day
+
+def _month_keys(start_datetime: datetime, end_datetime: datetime):
+    month_keys = []
+    current_month = start_datetime.date().replace(day=1)
+    while current_month <= end_datetime.date():
+        month_keys.append(current_month.strftime("%Y-%m"))
+        current_month = (current_month + timedelta(days=32)).replace(day=1)
+    return month_keys
+
+def get_archived_months(db: Session, month_keys):
+    return db.query(models.ArchivedMonth).filter(models.ArchivedMonth.month.in_(month_keys)).all()
+
+def get_activity_seconds_by_day(db: Session, patient_id: int, start_datetime: datetime, end_datetime: datetime, until_activityframe_id: int = None, include_overnight: bool = False):
+    # Returns {"YYYY-MM-DD": {activity_id: seconds}}, summed from hot frames and archived rollups.
+    # With `include_overnight`, frames that run past midnight and finish within the range count toward their start day.
+    # With `until_activityframe_id`, frames with a higher id are left out.
+    seconds_by_day = {}
+
+    frame_filter = (
+        models.ActivityFrame.patient_id == patient_id,
+        models.ActivityFrame.date_started >= start_datetime,
+        models.ActivityFrame.date_finished <= end_datetime
+    )
+    if not include_overnight:
+        frame_filter += (_frame_within_day,)
+    if until_activityframe_id is not None:
+        frame_filter += (models.ActivityFrame.id <= until_activityframe_id,)
+
+    frame_totals = db.query(
+        _frame_day.label("day"),
+        models.ActivityFrame.activity_id,
+        _sql.func.sum(_frame_duration_in_seconds).label("seconds")
+    ).filter(*frame_filter).group_by("day", models.ActivityFrame.activity_id).all()
+
+    for day, activity_id, seconds in frame_totals:
+        day_totals = seconds_by_day.setdefault(day, {})
+        day_totals[activity_id] = day_totals.get(activity_id, 0) + (seconds or 0)
+
+    # Only look at rollups when part of the range has been archived
+    if get_archived_months(db=db, month_keys=_month_keys(start_datetime, end_datetime)):
+        rollups = db.query(models.ActivityFrameRollup).filter(
+            models.ActivityFrameRollup.patient_id == patient_id,
+            models.ActivityFrameRollup.date >= start_datetime.date(),
+            models.ActivityFrameRollup.date <= end_datetime.date()
+        ).all()
+
+        if include_overnight:
+            rollups += db.query(models.ActivityFrameOvernightRollup).filter(
+                models.ActivityFrameOvernightRollup.patient_id == patient_id,
+                models.ActivityFrameOvernightRollup.date >= start_datetime.date(),
+                models.ActivityFrameOvernightRollup.date_finished <= end_datetime.date()
+            ).all()
+
+        for rollup in rollups:
+            day_totals = seconds_by_day.setdefault(rollup.date.strftime("%Y-%m-%d"), {})
+            day_totals[rollup.activity_id] = day_totals.get(rollup.activity_id, 0) + rollup.duration_in_seconds
+
+    return seconds_by_day
+
+def get_first_activity_date(db: Session, patient_id: int):
+    first_frame = db.query(_sql.func.min(models.ActivityFrame.date_started)).filter(models.ActivityFrame.patient_id == patient_id).scalar()
+    first_rollup = db.query(_sql.func.min(models.ActivityFrameRollup.date)).filter(models.ActivityFrameRollup.patient_id == patient_id).scalar()
+    first_overnight_rollup = db.query(_sql.func.min(models.ActivityFrameOvernightRollup.date)).filter(
+        models.ActivityFrameOvernightRollup.patient_id == patient_id
+    ).scalar()
+    first_dates = [
+        first_date for first_date in (first_frame and first_frame.date(), first_rollup, first_overnight_rollup) if first_date is not None
+    ]
+    return min(first_dates) if first_dates else None
+
+def count_activityframes(db: Session, patient_id: int, until_activityframe_id: int):
+    return db.query(_sql.func.count(models.ActivityFrame.id)).filter(
+        models.ActivityFrame.patient_id == patient_id,
+        models.ActivityFrame.id <= until_activityframe_id
+    ).scalar()
+
+def get_new_activityframes_range(db: Session, patient_id: int, after_activityframe_id: int):
+    # Earliest start, highest id and number of the patient's frames with an id above `after_activityframe_id`
+    return db.query(
+        _sql.func.min(models.ActivityFrame.date_started),
+        _sql.func.max(models.ActivityFrame.id),
+        _sql.func.count(models.ActivityFrame.id)
+    ).filter(
+        models.ActivityFrame.patient_id == patient_id,
+        models.ActivityFrame.id > after_activityframe_id
+    ).one()
+
+def iter_population_activity_seconds(db: Session, start_datetime: datetime, end_datetime: datetime, patient_ids=None, yield_per: int = 5000):
+    # Streams (patient_id, day, activity_id, seconds) ordered by patient and day, from hot frames and archived rollups
+    frames = _sql.select(
+        models.ActivityFrame.patient_id,
+        _frame_day.label("day"),
+        models.ActivityFrame.activity_id,
+        _frame_duration_in_seconds.label("seconds")
+    ).where(
+        models.ActivityFrame.date_started >= start_datetime,
+        models.ActivityFrame.date_started < end_datetime,
+        _frame_within_day
+    )
+    if patient_ids:
+        frames = frames.where(models.ActivityFrame.patient_id.in_(patient_ids))
+    activity = frames
+
+    # Only look at rollups when part of the range has been archived
+    if get_archived_months(db=db, month_keys=_month_keys(start_datetime, end_datetime)):
+        rollups = _sql.select(
+            models.ActivityFrameRollup.patient_id,
+            _sql.func.date(models.ActivityFrameRollup.date).label("day"),
+            models.ActivityFrameRollup.activity_id,
+            models.ActivityFrameRollup.duration_in_seconds.label("seconds")
+        ).where(
+            models.ActivityFrameRollup.date >= start_datetime.date(),
+            models.ActivityFrameRollup.date < end_datetime.date()
+        )
+        if patient_ids:
+            rollups = rollups.where(models.ActivityFrameRollup.patient_id.in_(patient_ids))
+        activity = _sql.union_all(frames, rollups)
+
+    activity = activity.subquery()
+    query = _sql.select(
+        activity.c.patient_id,
+        activity.c.day,
+        activity.c.activity_id,
+        _sql.func.sum(activity.c.seconds)
+    ).group_by(
+        activity.c.patient_id, activity.c.day, activity.c.activity_id
+    ).order_by(
+        activity.c.patient_id, activity.c.day
+    ).execution_options(yield_per=yield_per)
+
+    return db.execute(query)
+
+# Archival of closed months
+_archive_metadata = _sql.MetaData(schema="archive")
+
+_archived_activityframes = _sql.Table(
+    "activityFrames", _archive_metadata,
+    _sql.Column("id", _sql.Integer, primary_key=True),
+    _sql.Column("patient_id", _sql.Integer),
+    _sql.Column("activity_id", _sql.Integer),
+    _sql.Column("date_started", _sql.DateTime),
+    _sql.Column("date_finished", _sql.DateTime),
+)
+
+def export_activityframes(db: Session, month_key: str, frame_filter):
+    # Copies the frames into a per-month SQLite file; re-running for the same month skips rows already exported
+    os.makedirs(database.ARCHIVE_DIRECTORY, exist_ok=True)
+    export_path = os.path.join(database.ARCHIVE_DIRECTORY, f"activityFrames_{month_key}.db")
+
+    frames = models.ActivityFrame.__table__
+    columns = [frames.c.id, frames.c.patient_id, frames.c.activity_id, frames.c.date_started, frames.c.date_finished]
+
+    # ATTACH and DETACH are not allowed inside a transaction, so use a connection of our own
+    with db.get_bind().connect() as connection:
+        connection.exec_driver_sql("ATTACH DATABASE ? AS archive", (export_path,))
+        try:
+            _archived_activityframes.create(connection, checkfirst=True)
+            connection.execute(
+                _archived_activityframes.insert().prefix_with("OR IGNORE").from_select(
+                    [column.name for column in columns],
+                    _sql.select(*columns).where(*frame_filter)
+                )
+            )
+            connection.commit()
+        finally:
+            connection.exec_driver_sql("DETACH DATABASE archive")
+
+    return export_path
+
+def archive_activityframes_month(db: Session, activity_month: datetime, export: bool = True):
+    month_key = activity_month.strftime("%Y-%m")
+    start_datetime = datetime.combine(activity_month.date().replace(day=1), time.min)
+    end_datetime = datetime.combine((start_datetime + timedelta(days=32)).date().replace(day=1), time.min)
+
+    # Frames inserted while the month is being archived stay hot until the next run
+    max_frame_id = db.query(_sql.func.max(models.ActivityFrame.id)).scalar() or 0
+    frame_filter = (
+        models.ActivityFrame.date_started >= start_datetime,
+        models.ActivityFrame.date_started < end_datetime,
+        models.ActivityFrame.id <= max_frame_id
+    )
+
+    export_path = export_activityframes(db=db, month_key=month_key, frame_filter=frame_filter) if export else None
+
+    daily_totals = db.query(
+        models.ActivityFrame.patient_id,
+        models.ActivityFrame.activity_id,
+        _frame_day.label("day"),
+        _sql.func.date(models.ActivityFrame.date_finished).label("day_finished"),
+        _sql.func.sum(_frame_duration_in_seconds).label("seconds"),
+        _sql.func.count(models.ActivityFrame.id).label("frame_count")
+    ).filter(*frame_filter).group_by(models.ActivityFrame.patient_id, models.ActivityFrame.activity_id, "day", "day_finished").all()
+
+    existing_rollups = {
+        (rollup.patient_id, rollup.activity_id, rollup.date, rollup.date): rollup
+        for rollup in db.query(models.ActivityFrameRollup).filter(
+            models.ActivityFrameRollup.date >= start_datetime.date(),
+            models.ActivityFrameRollup.date < end_datetime.date()
+        )
+    }
+    existing_rollups.update({
+        (rollup.patient_id, rollup.activity_id, rollup.date, rollup.date_finished): rollup
+        for rollup in db.query(models.ActivityFrameOvernightRollup).filter(
+            models.ActivityFrameOvernightRollup.date >= start_datetime.date(),
+            models.ActivityFrameOvernightRollup.date < end_datetime.date()
+        )
+    })
+
+    archived_frame_count = 0
+    for patient_id, activity_id, day, day_finished, seconds, frame_count in daily_totals:
+        rollup_date, rollup_date_finished = date.fromisoformat(day), date.fromisoformat(day_finished)
+        db_rollup = existing_rollups.get((patient_id, activity_id, rollup_date, rollup_date_finished))
+        if db_rollup is None:
+            if rollup_date_finished == rollup_date:
+                db_rollup = models.ActivityFrameRollup(patient_id=patient_id, activity_id=activity_id, date=rollup_date)
+            else:
+                # Ran past midnight
+                db_rollup = models.ActivityFrameOvernightRollup(
+                    patient_id=patient_id, activity_id=activity_id, date=rollup_date, date_finished=rollup_date_finished
+                )
+            db_rollup.duration_in_seconds = 0
+            db_rollup.frame_count = 0
+            db.add(db_rollup)
+            existing_rollups[(patient_id, activity_id, rollup_date, rollup_date_finished)] = db_rollup
+        db_rollup.duration_in_seconds += seconds or 0
+        db_rollup.frame_count += frame_count
+        archived_frame_count += frame_count
+
+    # The raw frames of the month disappear from the frame endpoints
+    for patient_id in {patient_id for patient_id, *_ in daily_totals}:
+        bump_patient_data_version(db=db, patient_id=patient_id)
+
+    db.query(models.ActivityFrame).filter(*frame_filter).delete(synchronize_session=False)
+
+    db_archived_month = db.get(models.ArchivedMonth, month_key)
+    if db_archived_month is None:
+        db_archived_month = models.ArchivedMonth(month=month_key, frame_count=0)
+        db.add(db_archived_month)
+    db_archived_month.frame_count += archived_frame_count
+    db_archived_month.date_archived = datetime.utcnow()
+    if export_path:
+        db_archived_month.export_path = export_path
+
+    db.commit()
+    db.refresh(db_archived_month)
+    return db_archived_month
+
+def archive_closed_months(db: Session, keep_months: int = 1, export: bool = True):
+    # Archives every month older than the last `keep_months` months (the current month included)
+    cutoff = datetime.utcnow().date().replace(day=1)
+    for _ in range(keep_months - 1):
+        cutoff = (cutoff - timedelta(days=1)).replace(day=1)
+
+    month_keys = db.query(
+        _sql.func.strftime("%Y-%m", models.ActivityFrame.date_started).label("month")
+    ).filter(
+        models.ActivityFrame.date_started < datetime.combine(cutoff, time.min)
+    ).distinct().all()
+
+    return [
+        archive_activityframes_month(db=db, activity_month=datetime.strptime(month_key, "%Y-%m"), export=export)
+        for (month_key,) in sorted(month_keys)
+    ]
\ No newline at end of file
@@ -0,0 +1,136 @@
+import threading
+
+from sqlalchemy.orm import Session
+from datetime import datetime, time, timedelta, timezone
+
+import app.schemas as _schemas
+import app.services as _services
+import app.singleflight as _singleflight
+
+# Activity ids as sent by the device, mapped to their field in DailySummary
+ACTIVITY_FIELDS = {
+    0: "randomMotion",
+    1: "clapping",
+    2: "brushingTeeth",
+    3: "cleaningHands",
+    4: "brushingHair",
+}
+
+# Daily targets reported by the daily summary
+DAILY_MOTION_TARGET_IN_SECONDS = 75*60
+DAILY_CLAPPING_TARGET_IN_SECONDS = 15*60
+
+# Summaries computed ahead of time, keyed by (kind, patient_id, period).
+# An entry is only served while the patient's data version is the one it was computed at.
+class SummaryStore:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._summaries = {}
+
+    def get(self, kind: str, patient_id: int, period: str, version: int):
+        with self._lock:
+            entry = self._summaries.get((kind, patient_id, period))
+        if entry is None or entry[0] != version:
+            return None
+        return entry[1]
+
+    def replace(self, entries: dict):
+        # entries: {(kind, patient_id, period): (version, summary)}
+        with self._lock:
+            self._summaries = dict(entries)
+
+    def __len__(self):
+        return len(self._summaries)
+
+
+precomputed = SummaryStore()
+
+def build_daily_summary(summary_date: datetime, seconds_by_activity: dict, motion_target, clapping_target):
+    durations = {field: int(seconds_by_activity.get(activity_id, 0)) for activity_id, field in ACTIVITY_FIELDS.items()}
+
+    return _schemas.DailySummary(
+        date=summary_date.strftime("%Y-%m-%d"),
+        motion=_schemas.ActivityDuration(
+            activityDurationInSeconds=sum(durations.values()),
+            activityTargetInSeconds=motion_target
+        ),
+        clapping=_schemas.ActivityDuration(
+            activityDurationInSeconds=durations["clapping"],
+            activityTargetInSeconds=clapping_target
+        ),
+        brushingTeeth=_schemas.ActivityDuration(
+            activityDurationInSeconds=durations["brushingTeeth"],
+            activityTargetInSeconds=None
+        ),
+        brushingHair=_schemas.ActivityDuration(
+            activityDurationInSeconds=durations["brushingHair"],
+            activityTargetInSeconds=None
+        ),
+        cleaningHands=_schemas.ActivityDuration(
+            activityDurationInSeconds=durations["cleaningHands"],
+            activityTargetInSeconds=None
+        ),
+        randomMotion=_schemas.ActivityDuration(
+            activityDurationInSeconds=durations["randomMotion"],
+            activityTargetInSeconds=None
+        ),
+    )
+
+def compute_daily_summary(db: Session, patient_id: int, activity_date: datetime):
+    start_datetime = datetime.combine(activity_date, time.min).replace(tzinfo=timezone.utc)
+    end_datetime = datetime.combine(activity_date, time.max).replace(tzinfo=timezone.utc)
+    seconds_by_day = _services.get_activity_seconds_by_day(db=db, patient_id=patient_id, start_datetime=start_datetime, end_datetime=end_datetime)
+
+    seconds_by_activity = {}
+    for day_totals in seconds_by_day.values():
+        for activity_id, seconds in day_totals.items():
+            seconds_by_activity[activity_id] = seconds_by_activity.get(activity_id, 0) + seconds
+
+    return build_daily_summary(activity_date, seconds_by_activity, motion_target=DAILY_MOTION_TARGET_IN_SECONDS, clapping_target=DAILY_CLAPPING_TARGET_IN_SECONDS)
+
+def compute_monthly_summary(db: Session, patient_id: int, activity_month: datetime):
+    # Calculate the start_date (first day of the month) and end_date (last day of the month)
+    start_date = datetime.combine(activity_month.replace(day=1), time.min).replace(tzinfo=timezone.utc)
+    next_month = (activity_month.replace(day=28) + timedelta(days=4)).replace(day=1)
+    end_date = (next_month - timedelta(days=1)).replace(hour=23, minute=59, second=59).replace(tzinfo=timezone.utc)
+
+    # A frame running past midnight counts toward the day it started, as long as it finishes within the month
+    seconds_by_day = _services.get_activity_seconds_by_day(
+        db=db, patient_id=patient_id, start_datetime=start_date, end_datetime=end_date, include_overnight=True
+    )
+
+    monthly_summaries = []
+    current_date = start_date
+    while current_date <= end_date:
+        #  TODO: change 600
+        monthly_summaries.append(build_daily_summary(
+            current_date, seconds_by_day.get(current_date.strftime("%Y-%m-%d"), {}), motion_target=600, clapping_target=None
+        ))
+        current_date += timedelta(days=1)
+
+    return _schemas.MonthlySummary(monthlySummaries=monthly_summaries)
+
+
+# Identical summary requests that arrive while one is being computed wait for it instead of computing again
+coalescer = _singleflight.SingleFlight()
+
+# Serve from the precomputed store when the data has not changed since, compute otherwise
+def get_daily_summary(db: Session, patient_id: int, activity_date: datetime, version: int):
+    period = activity_date.strftime("%Y-%m-%d")
+    summary = precomputed.get("daily", patient_id, period, version)
+    if summary is None:
+        summary = coalescer.do(
+            ("daily", patient_id, period, version),
+            lambda: compute_daily_summary(db=db, patient_id=patient_id, activity_date=activity_date)
+        )
+    return summary
+
+def get_monthly_summary(db: Session, patient_id: int, activity_month: datetime, version: int):
+    period = activity_month.strftime("%Y-%m")
+    summary = precomputed.get("monthly", patient_id, period, version)
+    if summary is None:
+        summary = coalescer.do(
+            ("monthly", patient_id, period, version),
+            lambda: compute_monthly_summary(db=db, patient_id=patient_id, activity_month=activity_month)
+        )
+    return summary
\ No newline at end of file